@@ -0,0 +1,222 @@
+'''Benchmark _get_paginate_by and _paginate.
+
+Usage: python -m benchmarks.pagination [--rows 1000 100000] [--per-page 25]
+    [--repeat 5]
+
+Runs against tests/test_settings.py with an in-memory SQLite database
+seeded with --rows users. Every case reports its query count, best wall
+time of --repeat runs and peak traced allocations (measured on a separate
+run, tracemalloc slows everything down).
+'''
+# PSL
+import os
+import time
+import argparse
+import itertools
+import tracemalloc
+from unittest import mock
+
+STORES = (  # name, MODELS settings
+    ('session', {
+        'session_per_page_store': True, 'db_per_page_store': False,
+    }),
+    ('db json', {
+        'session_per_page_store': False, 'db_per_page_store': True,
+        'db_per_page_backend': 'json',
+    }),
+    ('db normalized', {
+        'session_per_page_store': False, 'db_per_page_store': True,
+        'db_per_page_backend': 'normalized',
+    }),
+)
+COUNTS = ('exact', 'cached', 'estimate', 'probe')
+ROW = '{:>8} {:<22} {:>8} {:>8} {:>10} {:>12}'
+
+
+def _setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = ':memory:'
+    django.setup()
+
+    from django.core import management
+    management.call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def _seed(rows):
+    from django.contrib import auth
+
+    User = auth.get_user_model()
+    User.objects.all().delete()
+    User.objects.bulk_create(
+        [User(username='user{:08}'.format(i)) for i in range(rows)]
+    )
+
+    return User.objects.order_by('username').first()
+
+
+def _measure(func, repeat, setup=None):
+    from django.db import connection
+    from django.test import utils
+
+    def run():
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    best = min(run() for _i in range(repeat))
+
+    if setup is not None:
+        setup()
+    with utils.CaptureQueriesContext(connection) as queries:
+        func()
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return len(queries), best, peak
+
+
+def _print(rows, case, page, result):
+    queries, best, peak = result
+    print(ROW.format(
+        rows, case, page, queries, '{:.2f}'.format(best * 1000),
+        '{:.1f}'.format(peak / 1024)
+    ))
+
+
+def _get_request(user, **data):
+    from django import test
+
+    request = test.RequestFactory().get('/', data)
+    request.user = user
+    request.session = {}
+
+    return request
+
+
+def _bench_paginate_by(rows, user, per_page, repeat):
+    from django.core.cache import cache
+    from utils import views_utils
+    from utils.conf import settings
+
+    for name, store in STORES:
+        with mock.patch.dict(settings['MODELS'], store):
+            # reads, cold then from django's cache
+            _print(rows, name + ' read', 'cold', _measure(
+                lambda: views_utils._get_paginate_by(
+                    _get_request(user), 'rows'
+                ),
+                repeat, setup=cache.clear
+            ))
+            _print(rows, name + ' read', 'warm', _measure(
+                lambda: views_utils._get_paginate_by(
+                    _get_request(user), 'rows'
+                ),
+                repeat
+            ))
+            # alternate values so every run writes, both under
+            #  rows_per_page_max or they would be clamped to the same one
+            values = itertools.cycle((per_page, max(1, per_page - 1)))
+            _print(rows, name + ' write', '-', _measure(
+                lambda: views_utils._get_paginate_by(
+                    _get_request(user, rows=next(values)), 'rows'
+                ),
+                repeat
+            ))
+
+
+def _bench_paginate(rows, per_page, repeat):
+    import math
+    from django.contrib import auth
+    from django.core.cache import cache
+    from utils import views_utils, background_utils
+    from utils.conf import settings
+
+    User = auth.get_user_model()
+    queryset = User.objects.order_by('username')
+    last = max(1, math.ceil(rows / per_page))
+    pages = (('first', 1), ('middle', (last + 1) // 2), ('last', last))
+
+    def paginate(number, **kwargs):
+        request = _get_request(None, page=number)
+        # evaluate the page, like rendering it would
+        list(views_utils._paginate(
+            request, queryset.all(), 'page', per_page, **kwargs
+        ))
+
+    # the cache isn't cleared, cached is measured with its count cached
+    for count in COUNTS:
+        for label, number in pages:
+            _print(rows, count, label, _measure(
+                lambda: paginate(number, count=count), repeat
+            ))
+
+    # the request after the previous page warmed this one, warming the
+    #  next page is left out as it happens in the background
+    def prefetched(number):
+        with mock.patch.object(background_utils, 'submit'):
+            paginate(number, prefetch_next=True)
+
+    with mock.patch.dict(
+        settings['MODELS'], prefetch_next_background=False
+    ):
+        for label, number in pages[1:]:
+            def setup():
+                cache.clear()
+                paginate(number - 1, prefetch_next=True)
+
+            _print(rows, 'exact prefetch_next', label, _measure(
+                lambda: prefetched(number), repeat, setup=setup
+            ))
+
+    ordering = views_utils._get_keyset_ordering(queryset)
+    for label, number in pages:
+        cursor = None
+        if number > 1:
+            previous = queryset[(number - 1) * per_page - 1]
+            cursor = views_utils._get_cursor(
+                previous, ordering, views_utils.NEXT
+            )
+
+        def keyset():
+            data = {'page': cursor} if cursor else {}
+            request = _get_request(None, **data)
+            list(views_utils._paginate(
+                request, queryset.all(), 'page', per_page, keyset=True
+            ))
+
+        _print(rows, 'keyset', label, _measure(keyset, repeat))
+
+
+def run(rows=(1000, 100000), per_page=25, repeat=5):
+    _setup()
+
+    from utils.conf import settings
+
+    print(ROW.format(
+        'rows', 'case', 'page', 'queries', 'best (ms)', 'peak (KiB)'
+    ))
+    with mock.patch.dict(settings['MODELS'], rows_per_page_max=per_page):
+        for count in rows:
+            user = _seed(count)
+            _bench_paginate_by(count, user, per_page, repeat)
+            _bench_paginate(count, per_page, repeat)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--per-page', type=int, default=25)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    run(rows=args.rows, per_page=args.per_page, repeat=args.repeat)
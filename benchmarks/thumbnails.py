@@ -0,0 +1,112 @@
+'''Benchmark _rescale with and without the draft/reduce fast path.
+
+Usage: python -m benchmarks.thumbnails [repeat]
+
+Decoded px is the size of the bitmap decoded from the source, i.e. a proxy
+for peak memory. Pillow >= 7 already drafts inside Image.thumbnail so the
+gain is mostly on the force (ImageOps.fit) path.
+'''
+# PSL
+import os
+import sys
+import time
+import shutil
+import tempfile
+from unittest import mock
+
+SIZES = (  # 12MP, 24MP, 48MP
+    (4000, 3000),
+    (6000, 4000),
+    (8000, 6000),
+)
+THUMBNAIL_SIZES = (128, 256)
+
+
+def _make_image(directory, size):
+    from PIL import Image
+
+    # noise defeats any shortcut jpeg could take on flat colour, it is a
+    #  worst case for entropy decoding which DCT scaling cannot skip
+    bands = [Image.effect_noise(size, 64) for _i in range(3)]
+    img = Image.merge('RGB', bands)
+    filename = os.path.join(directory, '{}x{}.jpg'.format(*size))
+    img.save(filename, 'JPEG', quality=90)
+    img.close()
+
+    return filename
+
+
+def _decoded_pixels(filename, size, draft):
+    from PIL import Image
+
+    with Image.open(filename) as img:
+        if draft:
+            img.draft(img.mode, size)
+        return img.size[0] * img.size[1]
+
+
+def _time(func, repeat):
+    best = None
+    for _i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def run(repeat=3):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+    import django
+    django.setup()
+
+    from utils import views
+    from utils.conf import settings
+
+    directory = tempfile.mkdtemp()
+    try:
+        row = '{:>10} {:>5} {:>6} {:>8} {:>8} {:>8} {:>16}'
+        print(row.format(
+            'source', 'thumb', 'force', 'old (s)', 'new (s)', 'speedup',
+            'decoded px'
+        ))
+        for size in SIZES:
+            filename = _make_image(directory, size)
+            for thumbnail_size in THUMBNAIL_SIZES:
+                for force in (False, True):
+                    timings = []
+                    for draft in (False, True):
+                        with mock.patch.dict(
+                            settings['THUMBNAILS'], draft=draft
+                        ):
+                            timings.append(_time(
+                                lambda: views._rescale(
+                                    filename, thumbnail_size,
+                                    thumbnail_size, force=force
+                                ),
+                                repeat
+                            ))
+                    old, new = timings
+                    print(row.format(
+                        '{}x{}'.format(*size),
+                        thumbnail_size,
+                        str(force),
+                        '{:.3f}'.format(old),
+                        '{:.3f}'.format(new),
+                        '{:.1f}x'.format(old / new),
+                        '{:.1f} -> {:.2f}MP'.format(
+                            _decoded_pixels(
+                                filename, (thumbnail_size,) * 2, False
+                            ) / 10 ** 6,
+                            _decoded_pixels(
+                                filename, (thumbnail_size,) * 2, True
+                            ) / 10 ** 6,
+                        ),
+                    ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -4,6 +4,14 @@ from os import path
 
 from django.db import models
 from django.conf import settings
+from django.contrib.auth import models as auth_models
+
+from utils import model_utils
+
+
+class User(auth_models.AbstractUser):
+    # maintained by ActiveUserMiddleware
+    last_active = models.DateTimeField(null=True, blank=True, db_index=True)
 
 
 class File(models.Model):
@@ -17,3 +25,23 @@ class File(models.Model):
 
     def __str__(self):
         return '{}'.format(self.filename())
+
+
+class Image(models.Model):
+    image = model_utils.ImageField(
+        upload_to='tests/', blank=True, thumbnail_sizes=((64, 64),)
+    )
+
+
+class Document(model_utils.FieldList, models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    file = models.OneToOneField(File, null=True, blank=True)
+    reviewer = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, related_name='+'
+    )
+
+    title = models.CharField(max_length=255)
+    status = models.CharField(
+        max_length=1, choices=(('d', 'Draft'), ('p', 'Published')),
+        default='d'
+    )
@@ -35,4 +35,12 @@ DATABASES = {
 
 ROOT_URLCONF = 'tests.urls'
 
+AUTH_USER_MODEL = 'tests.User'
+
 MEDIA_ROOT = BASE_DIR + '/tests/media/'
+
+UTILS = {
+    'THUMBNAILS': {
+        'background': False,
+    },
+}
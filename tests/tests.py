@@ -1,16 +1,37 @@
+import os
+import sys
+import datetime
+import shutil
+import tempfile
+import time
+import threading
+import io
+import asyncio
 import itertools
+import unittest
 from os import path
+from unittest import mock
 
 from django import test, forms
 from django.conf import settings
 from django.contrib import auth
 from django.utils import timezone
+from django.core import management
+from django.core.cache import cache
+from django.db import connection
+from django.template import loader
 from django.core.files import storage, uploadedfile
 from django.utils import datastructures
 
 from formtools.wizard.storage import exceptions
 from utils.templatetags import update_attrs
+from utils.templatetags import active_users as active_users_tags
 from utils.forms import widgets
+from utils.middleware import active_users
+from utils import (
+    views as utils_views, views_utils, thumbnail_utils, models as utils_models,
+    activity_utils, background_utils
+)
 
 from . import (
     models as tests_models, forms as tests_forms, views as tests_views
@@ -1395,3 +1416,948 @@ class MultiFileFieldTests(test.TestCase):
         self.assertEqual(user.username, 'test1')
         self.assertEqual(tests_models.File.objects.count(), 0)
         files[0].file.delete()
+
+
+class ThumbnailTests(test.TestCase):
+    def setUp(self):
+        from PIL import Image
+
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = test.override_settings(
+            MEDIA_ROOT=self.media_root, MEDIA_URL='/media/'
+        )
+        self.settings_override.enable()
+
+        Image.new('RGB', (640, 480), 'red').save(
+            path.join(self.media_root, 'image.jpg')
+        )
+        self.factory = test.RequestFactory()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def get_thumbnail(self, width=128, height=128, **extra):
+        request = self.factory.get('/', **extra)
+        return utils_views.get_thumbnail(
+            request, str(width), str(height), '/media/image.jpg'
+        )
+
+    def test_cache(self):
+        response = self.get_thumbnail()
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertTrue(response.content)
+
+        # warm cache, no decoding
+        with mock.patch.object(utils_views, '_rescale') as rescale:
+            cached_response = self.get_thumbnail()
+        self.assertFalse(rescale.called)
+        self.assertEqual(
+            b''.join(cached_response.streaming_content), response.content
+        )
+
+        # different geometry is a different entry
+        with mock.patch.object(
+            utils_views, '_rescale', return_value=b'data'
+        ) as rescale:
+            self.get_thumbnail(256, 256)
+        self.assertTrue(rescale.called)
+
+    def test_set_cached(self):
+        storage = thumbnail_utils.get_storage()
+        name = 'thumbnails/ab/abc.jpg'
+        replace = os.replace
+
+        # the name only appears once it is completely written
+        def check_replace(src, dst):
+            self.assertFalse(storage.exists(name))
+            with open(src, 'rb') as _file:
+                self.assertEqual(_file.read(), b'data')
+            replace(src, dst)
+
+        with mock.patch.object(
+            os, 'replace', side_effect=check_replace
+        ) as os_replace:
+            thumbnail_utils.set_cached(name, b'data')
+        self.assertTrue(os_replace.called)
+        with storage.open(name) as _file:
+            self.assertEqual(_file.read(), b'data')
+        self.assertEqual(storage.listdir('thumbnails/ab')[1], ['abc.jpg'])
+
+    def test_sweep_cache(self):
+        image_path = path.join(self.media_root, 'image.jpg')
+        self.get_thumbnail(64, 64)
+        self.get_thumbnail(128, 128)
+        storage = thumbnail_utils.get_storage()
+        old_name = thumbnail_utils.get_cache_name(image_path, 64, 64)
+        new_name = thumbnail_utils.get_cache_name(image_path, 128, 128)
+        # 64x64 is least recently used
+        os.utime(storage.path(old_name), (0, 0))
+
+        self.assertEqual(thumbnail_utils.sweep_cache(), 0)
+        max_size = storage.size(new_name)
+        self.assertEqual(thumbnail_utils.sweep_cache(max_size=max_size), 1)
+        self.assertFalse(storage.exists(old_name))
+        self.assertTrue(storage.exists(new_name))
+
+        # the periodic sweep is handed to the background pool
+        with mock.patch.object(
+            thumbnail_utils, '_last_sweep', 0
+        ), mock.patch.object(background_utils, 'submit') as submit:
+            self.get_thumbnail(256, 256)
+        submit.assert_called_once_with(
+            'THUMBNAILS', 'background', thumbnail_utils.sweep_cache,
+            max_workers=mock.ANY
+        )
+
+    def test_conditional_get(self):
+        response = self.get_thumbnail()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age=', response['Cache-Control'])
+        etag = response['ETag']
+
+        with mock.patch.object(utils_views, '_rescale') as rescale:
+            response = self.get_thumbnail(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(rescale.called)
+
+        # other geometries and modified sources are other entities
+        response = self.get_thumbnail(256, 256, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        os.utime(path.join(self.media_root, 'image.jpg'), (0, 0))
+        response = self.get_thumbnail(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_serve(self):
+        image_path = path.join(self.media_root, 'image.jpg')
+        self.get_thumbnail()
+        cache_name = thumbnail_utils.get_cache_name(image_path, 128, 128)
+        storage = thumbnail_utils.get_storage()
+
+        with mock.patch.dict(
+            thumbnail_utils.settings['THUMBNAILS'], serve='x-sendfile'
+        ):
+            response = self.get_thumbnail()
+        self.assertEqual(response['X-Sendfile'], storage.path(cache_name))
+        self.assertFalse(response.content)
+
+        with mock.patch.dict(
+            thumbnail_utils.settings['THUMBNAILS'], serve='x-accel-redirect'
+        ):
+            response = self.get_thumbnail()
+        self.assertEqual(
+            response['X-Accel-Redirect'], '/media/' + cache_name
+        )
+        self.assertFalse(response.content)
+
+    def test_rescale(self):
+        from io import BytesIO
+        from PIL import Image
+
+        large_path = path.join(self.media_root, 'large.jpg')
+        Image.new('RGB', (4000, 3000), 'red').save(large_path)
+
+        for draft in (False, True):
+            with mock.patch.dict(
+                thumbnail_utils.settings['THUMBNAILS'], draft=draft
+            ):
+                data = utils_views._rescale(large_path, 128, 128, force=False)
+                self.assertEqual(Image.open(BytesIO(data)).size, (128, 96))
+                data = utils_views._rescale(large_path, 128, 128, force=True)
+                self.assertEqual(Image.open(BytesIO(data)).size, (128, 128))
+
+    def test_rescale_orientation(self):
+        from io import BytesIO
+        from PIL import Image
+
+        rotated_path = path.join(self.media_root, 'rotated.jpg')
+        exif = Image.Exif()
+        exif[utils_views.EXIF_ORIENTATION] = 6  # rotated 90 CW
+        Image.new('RGB', (200, 100), 'red').save(
+            rotated_path, exif=exif.tobytes()
+        )
+
+        data = utils_views._rescale(rotated_path, 128, 128, force=False)
+        img = Image.open(BytesIO(data))
+        self.assertEqual(img.size, (64, 128))
+        self.assertNotIn('exif', img.info)
+
+    def test_warm_thumbnails(self):
+        with open(path.join(self.media_root, 'image.jpg'), 'rb') as _file:
+            tests_models.Image.objects.create(
+                image=uploadedfile.SimpleUploadedFile('image.jpg', _file.read())
+            )
+        tests_models.Image.objects.create()  # no image
+
+        count = 2 * len(thumbnail_utils.get_formats())  # 2 sizes
+        stdout = io.StringIO()
+        management.call_command('warm_thumbnails', workers=1, stdout=stdout)
+        self.assertIn(
+            '{} generated, 0 skipped, 0 failed'.format(count),
+            stdout.getvalue()
+        )
+
+        with mock.patch.object(utils_views, '_rescale') as rescale:
+            response = utils_views.get_thumbnail(
+                self.factory.get('/'), '128', '128', '/media/tests/image.jpg'
+            )
+        self.assertFalse(rescale.called)
+        self.assertEqual(response.status_code, 200)
+
+        # incremental
+        stdout = io.StringIO()
+        management.call_command('warm_thumbnails', workers=1, stdout=stdout)
+        self.assertIn(
+            '0 generated, {} skipped, 0 failed'.format(count),
+            stdout.getvalue()
+        )
+
+        # failures are logged
+        stdout = io.StringIO()
+        with mock.patch.object(
+            utils_views, 'generate_thumbnail', side_effect=OSError('broken')
+        ), self.assertLogs(
+            'utils.management.commands.warm_thumbnails', 'ERROR'
+        ) as logs:
+            management.call_command(
+                'warm_thumbnails', workers=1, stdout=stdout
+            )
+        self.assertIn('{} failed'.format(count), stdout.getvalue())
+        self.assertIn('OSError: broken', logs.output[0])
+
+    def test_image_field_thumbnails(self):
+        with open(path.join(self.media_root, 'image.jpg'), 'rb') as _file:
+            content = _file.read()
+        image = tests_models.Image.objects.create(
+            image=uploadedfile.SimpleUploadedFile('image.jpg', content)
+        )
+        utils_views.generate_thumbnail(image.image.url, 128, 128)
+        old_path = image.image.path
+        old_names = [
+            thumbnail_utils.get_cache_name(old_path, 64, 64),
+            thumbnail_utils.get_cache_name(old_path, 128, 128),
+        ]
+        # generated on save
+        for name in old_names:
+            self.assertTrue(thumbnail_utils.is_cached(name))
+
+        field = tests_models.Image._meta.get_field('image')
+        field.save_form_data(
+            image, uploadedfile.SimpleUploadedFile('other.jpg', content)
+        )
+        image.save()
+
+        # replaced along with the file
+        self.assertFalse(path.exists(old_path))
+        for name in old_names:
+            self.assertFalse(thumbnail_utils.is_cached(name))
+        self.assertTrue(thumbnail_utils.is_cached(
+            thumbnail_utils.get_cache_name(image.image.path, 64, 64)
+        ))
+
+        # not for fixtures
+        with mock.patch.object(background_utils, 'submit') as submit:
+            image.save_base(raw=True)
+        self.assertFalse(submit.called)
+
+    def test_format(self):
+        from PIL import Image
+
+        response = self.get_thumbnail(HTTP_ACCEPT='image/*,*/*;q=0.8')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('Accept', response['Vary'])
+        jpeg_etag = response['ETag']
+
+        if not thumbnail_utils.is_supported(thumbnail_utils.WEBP):
+            return
+
+        response = self.get_thumbnail(
+            HTTP_ACCEPT='image/webp,image/*,*/*;q=0.8'
+        )
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertNotEqual(response['ETag'], jpeg_etag)
+        response = self.get_thumbnail(HTTP_ACCEPT='image/webp;q=0,*/*')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        # transparency is kept
+        png_path = path.join(self.media_root, 'image.png')
+        Image.new('RGBA', (640, 480), (0, 0, 0, 0)).save(png_path)
+        data = utils_views._rescale(
+            png_path, 128, 128, fmt=thumbnail_utils.WEBP
+        )
+        self.assertEqual(Image.open(io.BytesIO(data)).mode, 'RGBA')
+
+    def test_budget(self):
+        response = self.get_thumbnail(4096, 128)
+        self.assertEqual(response.status_code, 400)
+        response = self.get_thumbnail(0, 128)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+        # source over the pixel budget
+        with mock.patch.dict(
+            thumbnail_utils.settings['THUMBNAILS'], max_pixels=100
+        ):
+            response = self.get_thumbnail()
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertIn('no-store', response['Cache-Control'])
+        # not validated as the real thumbnail
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # no decode slot free
+        with mock.patch.dict(
+            thumbnail_utils.settings['THUMBNAILS'],
+            max_concurrency=1, concurrency_timeout=0.01
+        ), mock.patch.object(thumbnail_utils, '_decode_semaphore', None):
+            with thumbnail_utils.decode_slot():
+                response = self.get_thumbnail()
+            self.assertEqual(response['Content-Type'], 'image/gif')
+
+            response = self.get_thumbnail()
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'requires asyncio.run')
+    def test_async(self):
+        from utils import async_views
+
+        def get_thumbnail(**extra):
+            request = self.factory.get('/', **extra)
+            return asyncio.run(async_views.get_thumbnail_async(
+                request, '128', '128', '/media/image.jpg'
+            ))
+
+        response = get_thumbnail()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        # hit, streamed
+        with mock.patch.object(utils_views, '_rescale') as rescale:
+            cached_response = get_thumbnail()
+        self.assertFalse(rescale.called)
+        self.assertTrue(cached_response.streaming)
+        self.assertEqual(
+            b''.join(cached_response.streaming_content), response.content
+        )
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+
+        response = get_thumbnail(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ActiveUserMiddlewareTests(test.TestCase):
+    def setUp(self):
+        cache.clear()
+        User = auth.get_user_model()
+        self.user = User.objects.create(username='test1')
+        self.middleware = active_users.ActiveUserMiddleware(
+            lambda request: None
+        )
+
+    def get_request(self):
+        request = test.RequestFactory().get('/')
+        # a fresh user each request, like the auth middleware
+        request.user = auth.get_user_model().objects.get(pk=self.user.pk)
+        return request
+
+    def test_update_user(self):
+        for _i in range(2):
+            request = self.get_request()
+            with self.assertNumQueries(1):
+                self.middleware(request)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_active)
+
+    def test_no_last_active(self):
+        from django.contrib.auth import models as auth_models
+
+        # a user model without last_active, nothing to write
+        with mock.patch.object(
+            auth, 'get_user_model', return_value=auth_models.User
+        ):
+            middleware = active_users.ActiveUserMiddleware(
+                lambda request: None
+            )
+        request = self.get_request()
+        with self.assertNumQueries(0):
+            middleware(request)
+
+    def test_update_interval(self):
+        with mock.patch.dict(
+            active_users.settings['ACTIVE_USERS'], update_interval=60
+        ):
+            request = self.get_request()
+            with self.assertNumQueries(1):
+                self.middleware(request)
+            request = self.get_request()
+            with self.assertNumQueries(0):
+                self.middleware(request)
+
+            # stored value is stale, but another request is writing
+            last_active = timezone.now() - datetime.timedelta(minutes=5)
+            auth.get_user_model().objects.update(last_active=last_active)
+            request = self.get_request()
+            with self.assertNumQueries(0):
+                self.middleware(request)
+
+            cache.clear()
+            request = self.get_request()
+            with self.assertNumQueries(1):
+                self.middleware(request)
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.last_active, last_active)
+
+    def test_buffer(self):
+        User = auth.get_user_model()
+        other = User.objects.create(username='test2')
+        with mock.patch.dict(
+            active_users.settings['ACTIVE_USERS'],
+            buffer=True, flush_background=False
+        ):
+            request = self.get_request()
+            with self.assertNumQueries(0):
+                self.middleware(request)
+            request.user = other
+            self.middleware(request)
+
+            with self.assertNumQueries(1):
+                self.assertEqual(activity_utils.flush(), 2)
+            self.assertEqual(activity_utils.flush(), 0)
+
+        self.assertEqual(
+            User.objects.filter(last_active__isnull=False).count(), 2
+        )
+        self.assertEqual(
+            User.objects.get(pk=other.pk).last_active, other.last_active
+        )
+
+
+class ActiveUsersTests(test.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.settings_patch = mock.patch.dict(
+            active_users_tags.settings['ACTIVE_USERS'], cache_timeout=0
+        )
+        self.settings_patch.start()
+
+    def tearDown(self):
+        self.settings_patch.stop()
+
+    def test_get_active_users(self):
+        User = auth.get_user_model()
+        now = timezone.now()
+        active = User.objects.create(username='test1', last_active=now)
+        User.objects.create(
+            username='test2', last_active=now - datetime.timedelta(hours=1)
+        )
+        User.objects.create(username='test3')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list(active_users_tags.get_active_users()), [active]
+            )
+        with mock.patch.dict(
+            active_users_tags.settings['ACTIVE_USERS'], window=2 * 60 * 60
+        ):
+            self.assertEqual(active_users_tags.get_active_users().count(), 2)
+
+    def test_presence(self):
+        class Redis:
+            # the sorted set commands presence uses
+            def __init__(self):
+                self.zset = {}
+
+            def zadd(self, key, mapping):
+                self.zset.update(
+                    (str(member).encode(), score)
+                    for member, score in mapping.items()
+                )
+
+            def zrangebyscore(self, key, min_score, max_score):
+                return sorted(
+                    (m for m, s in self.zset.items() if s >= min_score),
+                    key=self.zset.get
+                )
+
+            def zremrangebyscore(self, key, min_score, max_score):
+                max_score = float(max_score.lstrip('('))
+                for m, s in list(self.zset.items()):
+                    if s < max_score:
+                        del self.zset[m]
+
+        User = auth.get_user_model()
+        user = User.objects.create(username='test1')
+        other = User.objects.create(username='test2')
+        request = test.RequestFactory().get('/')
+        middleware = active_users.ActiveUserMiddleware(lambda request: None)
+        redis = Redis()
+
+        with mock.patch.dict(
+            active_users.settings['ACTIVE_USERS'], presence=True
+        ), mock.patch.object(
+            activity_utils, '_get_redis', return_value=redis
+        ), mock.patch.object(activity_utils, '_last_trim', 0):
+            request.user = user
+            with self.assertNumQueries(0):
+                middleware(request)
+            request.user = other
+            middleware(request)
+            redis.zset[str(other.pk).encode()] -= 60 * 60
+
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    list(active_users_tags.get_active_users()), [user]
+                )
+        self.assertEqual(list(redis.zset), [str(user.pk).encode()])
+        self.assertIsNone(User.objects.get(pk=user.pk).last_active)
+
+    def test_cache_timeout(self):
+        User = auth.get_user_model()
+        user = User.objects.create(
+            username='test1', last_active=timezone.now()
+        )
+
+        def get_active_users(now):
+            with mock.patch.dict(
+                active_users_tags.settings['ACTIVE_USERS'], cache_timeout=30
+            ), mock.patch.object(
+                active_users_tags.time, 'time', return_value=now
+            ):
+                return list(active_users_tags.get_active_users())
+
+        with self.assertNumQueries(2):  # pks, users
+            self.assertEqual(get_active_users(3000), [user])
+        with self.assertNumQueries(1):
+            self.assertEqual(get_active_users(3029), [user])
+
+        # next bucket, another worker is recomputing it
+        other = User.objects.create(
+            username='test2', last_active=timezone.now()
+        )
+        cache.add(active_users_tags._get_cache_key(101) + '|lock', True)
+        self.assertEqual(get_active_users(3030), [user])
+
+        cache.delete(active_users_tags._get_cache_key(101) + '|lock')
+        self.assertEqual(
+            sorted(get_active_users(3030), key=lambda u: u.pk), [user, other]
+        )
+
+
+class FieldListTests(test.TestCase):
+    def test_get_all_fields(self):
+        user = auth.get_user_model().objects.create(username='test1')
+        document = tests_models.Document.objects.create(
+            user=user, title='title', status='p'
+        )
+
+        fields = document.get_all_fields()
+        self.assertEqual(
+            list(fields),
+            ['id', 'user', 'file', 'reviewer', 'title', 'status']
+        )
+        self.assertEqual(fields['user'].value, user)
+        self.assertIsNone(fields['file'].value)
+        self.assertEqual(fields['status'].value, 'Published')
+        name, field_value = list(fields.items())[-1]
+        self.assertEqual(name, 'status')
+        self.assertEqual(field_value.field.verbose_name, 'status')
+        self.assertIs(
+            tests_models.Document.get_field_list_meta(),
+            document.get_field_list_meta()
+        )
+
+        # pseudo fields can still be added
+        btn = tests_models.Document.PseudoBtn('Edit')
+        fields.update({'edit': tests_models.Document.Field(btn, None)})
+        fields.move_to_end('edit', last=False)
+        self.assertEqual(list(fields)[:2], ['edit', 'id'])
+        self.assertEqual(fields['title'].value, 'title')
+        self.assertEqual(len(fields), 7)
+
+
+class PaginateTests(test.TestCase):
+    def setUp(self):
+        cache.clear()
+        User = auth.get_user_model()
+        self.user = User.objects.create(username='test1', password='password')
+        self.factory = test.RequestFactory()
+        self.settings_patch = mock.patch.dict(
+            views_utils.settings['MODELS'],
+            db_per_page_store=True, session_per_page_store=False
+        )
+        self.settings_patch.start()
+
+    def tearDown(self):
+        self.settings_patch.stop()
+
+    def get_request(self, **data):
+        request = self.factory.get('/', data)
+        request.user = self.user
+        request.session = {}
+        return request
+
+    def test_db_per_page_store(self):
+        request = self.get_request()
+        # one query per request, however many tables
+        with self.assertNumQueries(1):
+            self.assertEqual(views_utils._get_paginate_by(request, 'a'), 10)
+            self.assertEqual(views_utils._get_paginate_by(request, 'b'), 10)
+        # then django's cache
+        with self.assertNumQueries(0):
+            views_utils._get_paginate_by(self.get_request(), 'a')
+
+        request = self.get_request(a='20')
+        self.assertEqual(views_utils._get_paginate_by(request, 'a'), 20)
+        with self.assertNumQueries(0):
+            self.assertEqual(views_utils._get_paginate_by(request, 'a'), 20)
+        # written through
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                views_utils._get_paginate_by(self.get_request(), 'a'), 20
+            )
+        self.assertEqual(
+            utils_models.Paginate.objects.get(user=self.user)
+            .rows_per_page_json,
+            {'a': 20}
+        )
+
+    def test_set_rows_per_page(self):
+        utils_models.Paginate.set_rows_per_page(self.user.pk, 'a', '20')
+        utils_models.Paginate.set_rows_per_page(self.user.pk, 'b', '30')
+        utils_models.Paginate.set_rows_per_page(self.user.pk, 'a', '40')
+
+        paginate = utils_models.Paginate.objects.get(user=self.user)
+        self.assertEqual(paginate.rows_per_page_json, {'a': '40', 'b': '30'})
+
+    def test_rows_per_page_cache_race(self):
+        # a read that loaded the row before a write can't cache it after
+        request = self.get_request()
+        with mock.patch.object(
+            utils_models.Paginate, 'get_rows_per_page_json',
+            side_effect=lambda user_id: (
+                utils_models.Paginate.set_rows_per_page(user_id, 'a', 20)
+                or {}
+            )
+        ):
+            self.assertEqual(views_utils._get_paginate_by(request, 'a'), 10)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                views_utils._get_paginate_by(self.get_request(), 'a'), 20
+            )
+
+    def test_normalized_per_page_backend(self):
+        with mock.patch.dict(
+            views_utils.settings['MODELS'], db_per_page_backend='normalized'
+        ):
+            request = self.get_request(a='20')
+            self.assertEqual(views_utils._get_paginate_by(request, 'a'), 20)
+            request = self.get_request(b='30')
+            self.assertEqual(views_utils._get_paginate_by(request, 'b'), 30)
+            request = self.get_request(a='40')
+            self.assertEqual(views_utils._get_paginate_by(request, 'a'), 40)
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    views_utils._get_paginate_by(self.get_request(), 'b'), 30
+                )
+
+        self.assertFalse(
+            utils_models.Paginate.objects.filter(user=self.user).exists()
+        )
+        self.assertEqual(
+            utils_models.RowsPerPage.get_rows_per_page_json(self.user.pk),
+            {'a': 40, 'b': 30}
+        )
+
+        # the json backend's cached values are its own
+        self.assertEqual(
+            views_utils._get_paginate_by(self.get_request(), 'a'), 10
+        )
+
+    def test_copy_rows_per_page(self):
+        # saved with json after the migration copied the blobs
+        utils_models.RowsPerPage.set_rows_per_page(self.user.pk, 'a', 10)
+        utils_models.Paginate.set_rows_per_page(self.user.pk, 'a', 20)
+        utils_models.Paginate.set_rows_per_page(self.user.pk, 'b', 30)
+
+        stdout = io.StringIO()
+        management.call_command(
+            'copy_rows_per_page', to='normalized', stdout=stdout
+        )
+        self.assertIn('1 users', stdout.getvalue())
+        self.assertEqual(
+            utils_models.RowsPerPage.get_rows_per_page_json(self.user.pk),
+            {'a': 20, 'b': 30}
+        )
+
+        # and back, the normalized values win
+        utils_models.RowsPerPage.set_rows_per_page(self.user.pk, 'b', 40)
+        management.call_command(
+            'copy_rows_per_page', to='json', stdout=stdout
+        )
+        self.assertEqual(
+            utils_models.Paginate.get_rows_per_page_json(self.user.pk),
+            {'a': 20, 'b': 40}
+        )
+
+    def test_prefetch_related_fields(self):
+        User = auth.get_user_model()
+        documents = tests_models.Document.objects.order_by('pk')
+
+        def render(queryset, hidden_fields=()):
+            return loader.render_to_string(
+                'utils/generics/list_table.html', {
+                    'object_list': queryset, 'hidden_fields': hidden_fields,
+                    'disable_detail': True, 'disable_update': True,
+                    'disable_delete': True,
+                }
+            )
+
+        for count in (5, 10):
+            while documents.count() < count:
+                i = documents.count()
+                user = User.objects.create(username='user{}'.format(i))
+                tests_models.Document.objects.create(
+                    user=user, reviewer=user, title='title{}'.format(i),
+                    file=tests_models.File.objects.create(
+                        user=user, file='tests/{}.txt'.format(i)
+                    ),
+                )
+
+            with self.assertNumQueries(1):
+                rendered = render(
+                    views_utils._prefetch_related_fields(documents)
+                )
+            self.assertIn('user{}'.format(count - 1), rendered)
+            self.assertIn('{}.txt'.format(count - 1), rendered)
+            # hidden and prefetch fields are one query each
+            with self.assertNumQueries(3):
+                render(
+                    views_utils._prefetch_related_fields(
+                        documents, hidden_fields=['reviewer'],
+                        prefetch=['file']
+                    ),
+                    hidden_fields=['reviewer'],
+                )
+
+    def test_keyset_paginate(self):
+        User = auth.get_user_model()
+        for i in range(2, 26):
+            User.objects.create(username='test{}'.format(i))
+        queryset = User.objects.order_by('-date_joined')
+        expected = list(User.objects.order_by('-date_joined', '-pk'))
+
+        def get_page(cursor=None):
+            request = self.get_request(**({'page': cursor} if cursor else {}))
+            with self.assertNumQueries(1):  # no COUNT(*)
+                return views_utils._paginate(
+                    request, queryset, 'page', '10', keyset=True
+                )
+
+        page = get_page()
+        self.assertFalse(page.has_previous())
+        self.assertEqual(list(page), expected[:10])
+        page = get_page(page.next_cursor)
+        self.assertEqual(list(page), expected[10:20])
+        page = get_page(page.next_cursor)
+        self.assertEqual(list(page), expected[20:])
+        self.assertFalse(page.has_next())
+        page = get_page(page.previous_cursor)
+        self.assertEqual(list(page), expected[10:20])
+        page = get_page(page.previous_cursor)
+        self.assertEqual(list(page), expected[:10])
+        self.assertFalse(page.has_previous())
+
+        # tampered cursors are the first page
+        page = get_page('bad')
+        self.assertEqual(list(page), expected[:10])
+
+        rendered = loader.render_to_string(
+            'utils/snippets/keyset_pagination.html',
+            {'page_obj': page, 'page_var': 'page'}
+        )
+        self.assertIn(
+            'page=' + page.next_cursor.replace(':', '%3A'), rendered
+        )
+        self.assertNotIn('Previous', rendered)
+
+        # other params are kept, the current cursor is replaced
+        request = self.get_request(page=page.next_cursor, q='search')
+        page = views_utils._paginate(
+            request, queryset, 'page', '10', keyset=True
+        )
+        rendered = loader.render_to_string(
+            'utils/snippets/keyset_pagination.html',
+            {'page_obj': page, 'page_var': 'page', 'request': request}
+        )
+        self.assertEqual(rendered.count('page='), 2)
+        self.assertEqual(rendered.count('?q=search&page='), 2)
+
+    def test_keyset_paginate_related(self):
+        User = auth.get_user_model()
+        for i in range(5):
+            user = User.objects.create(username='user{}'.format(4 - i))
+            tests_models.Document.objects.create(
+                user=user, reviewer=user, title='title{}'.format(i)
+            )
+
+        for order_by in ('user__username', 'reviewer'):
+            queryset = tests_models.Document.objects.order_by(order_by)
+            expected = list(queryset.order_by(order_by, 'pk'))
+            object_list = []
+            cursor = None
+            while True:
+                request = self.get_request(
+                    **({'page': cursor} if cursor else {})
+                )
+                page = views_utils._paginate(
+                    request, queryset, 'page', 2, keyset=True
+                )
+                object_list += list(page)
+                if not page.has_next():
+                    break
+                cursor = page.next_cursor
+            self.assertEqual(object_list, expected)
+
+        # the FK's value is read without fetching the related row
+        document = tests_models.Document.objects.first()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                views_utils._get_cursor_value(document, 'reviewer'),
+                document.reviewer_id
+            )
+
+    def test_paginate_count(self):
+        User = auth.get_user_model()
+        for i in range(2, 26):
+            User.objects.create(username='test{}'.format(i))
+        queryset = User.objects.order_by('pk')
+
+        def paginate(count, page=None):
+            request = self.get_request(**({'page': page} if page else {}))
+            return views_utils._paginate(
+                request, queryset, 'page', 10, count=count
+            )
+
+        # count + page
+        with self.assertNumQueries(2):
+            page = paginate('cached')
+            self.assertEqual(len(list(page)), 10)
+            self.assertEqual(page.paginator.num_pages, 3)
+        with self.assertNumQueries(1):
+            page = paginate('cached')
+            self.assertEqual(len(list(page)), 10)
+            self.assertEqual(page.paginator.count, 25)
+
+        # not postgres, exact
+        with self.assertNumQueries(2):
+            page = paginate('estimate')
+            self.assertEqual(len(list(page)), 10)
+            self.assertEqual(page.paginator.count, 25)
+
+        with self.assertNumQueries(1):
+            page = paginate('probe')
+            self.assertTrue(page.has_next())
+            self.assertTrue(page.paginator.is_estimate)
+        with self.assertNumQueries(1):
+            page = paginate('probe', 3)
+            self.assertEqual(len(page), 5)
+            self.assertFalse(page.has_next())
+            self.assertTrue(page.has_previous())
+            self.assertEqual(page.paginator.count, 25)
+        # out of range, last page
+        page = paginate('probe', 9)
+        self.assertEqual(page.number, 3)
+
+    def test_paginate_prefetch_next(self):
+        User = auth.get_user_model()
+        for i in range(2, 26):
+            User.objects.create(username='test{}'.format(i))
+        queryset = User.objects.filter(is_active=True).order_by('-username')
+        expected = list(queryset.all())
+
+        def paginate(page):
+            request = self.get_request(page=page)
+            with mock.patch.dict(
+                views_utils.settings['MODELS'], prefetch_next_background=False
+            ):
+                return views_utils._paginate(
+                    request, queryset, 'page', 10, prefetch_next=True
+                )
+
+        page = paginate(1)
+        self.assertEqual(list(page), expected[:10])
+        key = page.paginator.get_page_cache_key(2)
+        self.assertEqual(
+            cache.get(key), [user.pk for user in expected[10:20]]
+        )
+        # page 2 is already warm, not warmed again
+        with test.utils.CaptureQueriesContext(connection) as queries:
+            list(paginate(1))
+        self.assertEqual(len(queries), 2)  # count, page 1
+
+        with test.utils.CaptureQueriesContext(connection) as queries:
+            page = paginate(2)
+            self.assertEqual(list(page), expected[10:20])
+        # count, page 2 by pk, then page 3's pks
+        self.assertEqual(len(queries), 3)
+        self.assertIn(' IN (', queries[1]['sql'])
+        self.assertNotIn('OFFSET 10', queries[1]['sql'])
+        self.assertEqual(
+            cache.get(page.paginator.get_page_cache_key(3)),
+            [user.pk for user in expected[20:]]
+        )
+        # rows deleted since are skipped
+        expected[20].delete()
+        self.assertEqual(list(paginate(3)), expected[21:])
+
+    def test_background_submit(self):
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+
+        def job():
+            started.set()
+            release.wait(5)
+
+        with mock.patch.dict(
+            views_utils.settings['MODELS'], prefetch_next_background=True
+        ):
+            def submit(func):
+                return background_utils.submit(
+                    'MODELS', 'prefetch_next_background', func,
+                    max_pending=1
+                )
+
+            self.assertTrue(submit(job))
+            started.wait(5)
+            # the pool is busy, further jobs are dropped not queued
+            self.assertFalse(submit(job))
+            release.set()
+            for _i in range(500):  # until the first job has finished
+                if submit(done.set):
+                    break
+                time.sleep(0.01)
+            self.assertTrue(done.wait(5))
+
+    def test_clean_rows_per_page(self):
+        def get_paginate_by(rows_per_page):
+            request = self.get_request(rows=rows_per_page)
+            return views_utils._get_paginate_by(request, 'rows')
+
+        self.assertEqual(get_paginate_by('1000000'), 100)  # clamped
+        self.assertEqual(get_paginate_by(''), 100)
+        self.assertEqual(get_paginate_by('abc'), 100)
+        self.assertEqual(get_paginate_by('-5'), 100)
+        with mock.patch.dict(
+            views_utils.settings['MODELS'], rows_per_page_choices=(10, 25)
+        ):
+            self.assertEqual(get_paginate_by('30'), 10)  # 100 not allowed
+            self.assertEqual(get_paginate_by('25'), 25)
+        self.assertEqual(
+            utils_models.Paginate.objects.get(user=self.user)
+            .rows_per_page_json,
+            {'rows': 25}
+        )
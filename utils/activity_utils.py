@@ -0,0 +1,140 @@
+# PSL
+import atexit
+import time
+import logging
+import threading
+# 3rd Party
+from django.contrib import auth
+from django.db import connections, models
+try:
+    from django_redis import get_redis_connection
+    HAS_DJANGO_REDIS = True
+except ImportError:
+    HAS_DJANGO_REDIS = False
+# Local
+from .conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# sqlite allows 999 params, each user takes 3
+BATCH_SIZE = 300
+
+_buffer = {}  # user id: latest activity
+_buffer_lock = threading.Lock()
+_flusher = None
+_last_trim = 0
+
+
+def record(user_id, now):
+    '''Buffer a user's activity, written by the next flush.'''
+    with _buffer_lock:
+        _buffer[user_id] = now
+
+    if settings['ACTIVE_USERS']['flush_background']:
+        _start_flusher()
+
+
+def flush():
+    '''Write buffered activity to last_active, one UPDATE per batch.
+
+    Returns the number of users updated.
+    '''
+    global _buffer
+
+    with _buffer_lock:
+        buffer, _buffer = _buffer, {}
+    if not buffer:
+        return 0
+
+    User = auth.get_user_model()
+    items = list(buffer.items())
+    for i in range(0, len(items), BATCH_SIZE):
+        batch = items[i:i + BATCH_SIZE]
+        User._default_manager.filter(
+            pk__in=[user_id for user_id, _now in batch]
+        ).update(last_active=models.Case(
+            *[models.When(pk=user_id, then=models.Value(now))
+              for user_id, now in batch],
+            output_field=User._meta.get_field('last_active')
+        ))
+
+    return len(items)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings['ACTIVE_USERS']['flush_interval'])
+        try:
+            flush()
+        except Exception:
+            logger.exception('Activity flush failed')
+        finally:
+            connections.close_all()  # only this thread's connections
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Activity flush failed')
+
+
+def _start_flusher():
+    global _flusher
+
+    if _flusher is not None:
+        return
+
+    with _buffer_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_forever, name='utils-activity-flush',
+                daemon=True
+            )
+            _flusher.start()
+            atexit.register(_flush_at_exit)
+
+
+def _get_redis():
+    if not HAS_DJANGO_REDIS:
+        raise ImportError(
+            "Please install 'django-redis' library to use ACTIVE_USERS "
+            "presence."
+        )
+
+    return get_redis_connection('default')
+
+
+def add_presence(user_id, now):
+    '''Score user_id with now in the presence sorted set.'''
+    _get_redis().zadd(
+        settings['ACTIVE_USERS']['presence_key'],
+        {user_id: now.timestamp()}
+    )
+
+
+def _maybe_trim(client, key, since):
+    global _last_trim
+
+    now = time.time()
+    if now - _last_trim < settings['ACTIVE_USERS']['presence_trim_interval']:
+        return
+    _last_trim = now
+
+    client.zremrangebyscore(key, '-inf', '({}'.format(since.timestamp()))
+
+
+def get_present_user_ids(since):
+    '''Get ids (as strings) of users present since, oldest first.
+
+    Entries older than since are periodically trimmed.
+    '''
+    client = _get_redis()
+    key = settings['ACTIVE_USERS']['presence_key']
+    _maybe_trim(client, key, since)
+
+    return [
+        member.decode() if isinstance(member, bytes) else member
+        for member in client.zrangebyscore(key, since.timestamp(), '+inf')
+    ]
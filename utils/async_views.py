@@ -0,0 +1,93 @@
+# PSL
+import os
+import asyncio
+import calendar
+# 3rd Party
+from django import http
+from django.utils import cache, http as http_utils
+# Local
+from . import views, thumbnail_utils
+
+
+''' async views for ASGI deployments (django >= 3.1), kept out of views.py
+so it still imports on pythons without async def
+path('thumbnail/<int:width>/<int:height>/<path:url>',
+     async_views.get_thumbnail_async),
+'''
+
+
+def _set_validators(response, etag, last_modified):
+    if last_modified:
+        response['Last-Modified'] = http_utils.http_date(last_modified)
+    if etag:
+        response['ETag'] = etag
+
+
+def _get_cached_thumbnail(request, width, height, url):
+    # blocking stats and opens, run in the loop's default executor
+    #  returns (response, None) or (None, render args) on a miss
+    etag = views._thumbnail_etag(request, width, height, url)
+    etag = http_utils.quote_etag(etag) if etag is not None else None
+    last_modified = views._thumbnail_last_modified(request, width, height, url)
+    if last_modified:
+        last_modified = calendar.timegm(last_modified.utctimetuple())
+    # same as the condition decorator on get_thumbnail
+    response = cache.get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is not None:
+        return response, None
+
+    path = views._get_media_path(url)
+    fmt = thumbnail_utils.get_format(request)
+    content_type = thumbnail_utils.get_content_type(fmt)
+    if not os.path.isfile(path):
+        return http.HttpResponse(content_type=content_type), None
+
+    cache_name = thumbnail_utils.get_cache_name(
+        path, width, height, force=False, fmt=fmt
+    )
+    # streamed, never read into memory
+    response = thumbnail_utils.get_cached_response(cache_name, content_type)
+    if response is None:
+        return None, (path, fmt, cache_name, etag, last_modified)
+
+    views._patch_thumbnail_headers(response)
+    _set_validators(response, etag, last_modified)
+
+    return response, None
+
+
+async def get_thumbnail_async(request, width, height, url):
+    '''get_thumbnail for ASGI deployments.
+
+    Stats and opens happen in the loop's default executor, hits are streamed
+    from the cache. Misses are rendered in
+    thumbnail_utils.get_async_executor().
+    '''
+    if not thumbnail_utils.is_valid_size(width, height):
+        return http.HttpResponseBadRequest()
+
+    loop = asyncio.get_running_loop()
+    response, miss = await loop.run_in_executor(
+        None, _get_cached_thumbnail, request, width, height, url
+    )
+    if miss is None:
+        return response
+
+    path, fmt, cache_name, etag, last_modified = miss
+    try:
+        thumbnail = await loop.run_in_executor(
+            thumbnail_utils.get_async_executor(),
+            views._render_thumbnail, path, width, height, fmt, cache_name
+        )
+    except thumbnail_utils.OverBudget:
+        return views._placeholder()
+
+    response = http.HttpResponse(
+        thumbnail, thumbnail_utils.get_content_type(fmt)
+    )
+    views._patch_thumbnail_headers(response)
+    _set_validators(response, etag, last_modified)
+
+    return response
@@ -0,0 +1,54 @@
+# PSL
+import logging
+import threading
+from concurrent import futures
+# 3rd Party
+from django.db import connections
+# Local
+from .conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_executors = {}  # (section, name): executor
+_pending = {}  # (section, name): queued or running jobs
+_lock = threading.Lock()
+
+
+def _run(key, func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background job %s failed', key)
+    finally:
+        connections.close_all()  # only this thread's connections
+        with _lock:
+            _pending[key] -= 1
+
+
+def submit(section, name, func, *args, max_workers=1, max_pending=None):
+    '''Run func off the request path in a thread pool per setting.
+
+    UTILS[section][name] turns the pool on, when False func runs
+    synchronously, e.g. in tests. With max_pending, jobs beyond that many
+    queued or running are dropped.
+
+    Returns False if the job was dropped.
+    '''
+    if not settings[section][name]:
+        func(*args)
+        return True
+
+    key = (section, name)
+    with _lock:
+        if max_pending is not None and _pending.get(key, 0) >= max_pending:
+            return False
+        _pending[key] = _pending.get(key, 0) + 1
+        if key not in _executors:
+            _executors[key] = futures.ThreadPoolExecutor(
+                max_workers=max_workers
+            )
+
+    _executors[key].submit(_run, key, func, *args)
+
+    return True
@@ -6,6 +6,8 @@ models = 'MODELS'
 base = 'BASE'
 generics = 'GENERICS'
 versions = 'VERSIONS'
+thumbnails = 'THUMBNAILS'
+active_users = 'ACTIVE_USERS'
 
 db_per_page_store = 'db_per_page_store'
 session_per_page_store = 'session_per_page_store'
@@ -14,6 +16,25 @@ settings = {
     models: {
         db_per_page_store: False,
         session_per_page_store: True,
+        # seconds db_per_page_store values stay in django's cache
+        'paginate_cache_timeout': 60 * 60,
+        # db_per_page_store model: json (Paginate, one blob per user) or
+        #  normalized (RowsPerPage, one row per user and table), run
+        #  copy_rows_per_page when switching
+        'db_per_page_backend': 'json',
+        # larger rows per page are clamped
+        'rows_per_page_max': 100,
+        # e.g. (10, 25, 50, 100), other values are ignored
+        'rows_per_page_choices': None,
+        # _paginate counting strategy: exact, cached, estimate or probe
+        'paginate_count': 'exact',
+        'count_cache_timeout': 60,  # seconds, cached
+        'count_estimate_threshold': 100000,  # rows, estimate
+        # _paginate warms the next page's pks in a background thread
+        'paginate_prefetch_next': False,
+        'prefetch_next_timeout': 30,  # seconds
+        'prefetch_next_background': True,
+        'prefetch_next_max_pending': 100,  # further warms are dropped
     },
     base: {
         'bootstrap3': False,
@@ -26,6 +47,62 @@ settings = {
         'base_template': 'base.html',
         'date_format': 'M. d, yyyy',
     },
+    active_users: {
+        # seconds between ActiveUserMiddleware last_active writes per user,
+        #  0 writes on every request
+        'update_interval': 0,
+        # buffer last_active in memory, written in one UPDATE per
+        #  flush_interval seconds by a background thread
+        'buffer': False,
+        'flush_interval': 60,
+        'flush_background': True,
+        # seconds since last_active get_active_users counts as active
+        'window': 10 * 60,
+        # seconds get_active_users results are cached, 0 disables
+        'cache_timeout': 30,
+        # track users in a redis sorted set (django-redis) instead of
+        #  last_active, get_active_users then only looks up their pks
+        'presence': False,
+        'presence_key': 'utils_presence',
+        'presence_trim_interval': 60,  # seconds
+    },
+    thumbnails: {
+        'cache': True,
+        # dotted path to a storage class, defaults to MEDIA_ROOT
+        'storage': None,
+        'cache_dir': 'thumbnails',
+        'cache_max_size': 256 * 1024 * 1024,  # bytes
+        'cache_sweep_interval': 60 * 5,  # seconds
+        'max_age': 60 * 60 * 24,  # seconds, Cache-Control
+        # decode large sources at a reduced scale before resampling
+        'draft': True,
+        'reducing_gap': 3.0,
+        # negotiated with the Accept header in order of preference, falls
+        #  back to jpeg, formats Pillow cannot encode are skipped
+        'formats': ('avif', 'webp'),
+        'quality': {'jpeg': 75, 'webp': 80, 'avif': 75},
+        'progressive': True,  # jpeg only
+        'optimize': True,  # jpeg only
+        # largest width/height accepted from the url
+        'max_size': 1024,
+        # sources decoding to more pixels are refused
+        'max_pixels': 50 * 1000 * 1000,
+        # concurrent decodes per process, None for unlimited
+        'max_concurrency': 4,
+        # seconds to wait for a decode slot before serving a placeholder
+        'concurrency_timeout': 10,
+        # threads rendering cache misses for get_thumbnail_async
+        'async_workers': 4,
+        # (width, height) pregenerated by warm_thumbnails
+        'sizes': ((128, 128), (256, 256)),
+        # generate ImageField thumbnail_sizes in a background thread pool
+        'background': True,
+        'background_workers': 2,
+        # how cached thumbnails are served: file, x-sendfile, x-accel-redirect
+        'serve': 'file',
+        # x-accel-redirect location of the storage, defaults to storage.url
+        'x_accel_redirect_prefix': None,
+    },
     versions: {
         'fallback_js': '1.1.8',
         'bootstrap_css': '3.3.6',
@@ -55,6 +132,24 @@ if invalid_pagination_store:
         'Use db_per_page_store or session_per_page_store, not both'
     )
 
+db_per_page_backends = ('json', 'normalized')
+if settings[models]['db_per_page_backend'] not in db_per_page_backends:
+    raise Exception(
+        'MODELS db_per_page_backend must be one of {}'.format(
+            ', '.join(db_per_page_backends)
+        )
+    )
+
 settings[base].update(django_settings_UTILS.get(base, {}))
 settings[generics].update(django_settings_UTILS.get(generics, {}))
 settings[versions].update(django_settings_UTILS.get(versions, {}))
+settings[thumbnails].update(django_settings_UTILS.get(thumbnails, {}))
+settings[active_users].update(django_settings_UTILS.get(active_users, {}))
+
+thumbnail_serves = ('file', 'x-sendfile', 'x-accel-redirect')
+if settings[thumbnails]['serve'] not in thumbnail_serves:
+    raise Exception(
+        'THUMBNAILS serve must be one of {}'.format(
+            ', '.join(thumbnail_serves)
+        )
+    )
@@ -0,0 +1,96 @@
+# PSL
+import json
+# 3rd Party
+from django.db import transaction
+from django.core.management import base
+# Local
+from ... import models
+from ...conf import settings
+
+
+''' copy stored rows per page between db_per_page_backends
+# run when switching UTILS['MODELS']['db_per_page_backend'], values stored
+#  in the backend switched to are overwritten by the one in use
+python manage.py copy_rows_per_page --to normalized
+'''
+
+
+def _get_rows_per_page_json(paginate):
+    try:
+        rows_per_page_json = json.loads(paginate.raw_rows_per_page)
+    except ValueError:
+        return {}
+
+    cleaned = {}
+    for rows_per_page_var, rows_per_page in rows_per_page_json.items():
+        try:
+            rows_per_page = int(rows_per_page)
+        except (TypeError, ValueError):
+            continue
+        if rows_per_page > 0:
+            cleaned[rows_per_page_var[:255]] = rows_per_page
+
+    return cleaned
+
+
+def _to_normalized():
+    users = 0
+    for paginate in models.Paginate.objects.all().iterator():
+        rows_per_page_json = _get_rows_per_page_json(paginate)
+        if not rows_per_page_json:
+            continue
+        with transaction.atomic():
+            for rows_per_page_var, rows_per_page in (
+                rows_per_page_json.items()
+            ):
+                models.RowsPerPage.objects.update_or_create(
+                    user_id=paginate.user_id,
+                    rows_per_page_var=rows_per_page_var,
+                    defaults={'rows_per_page': rows_per_page},
+                )
+        users += 1
+
+    return users
+
+
+def _to_json():
+    rows_per_page_jsons = {}
+    for row in models.RowsPerPage.objects.all().iterator():
+        rows_per_page_json = rows_per_page_jsons.setdefault(row.user_id, {})
+        rows_per_page_json[row.rows_per_page_var] = row.rows_per_page
+
+    for user_id, rows_per_page_json in rows_per_page_jsons.items():
+        with transaction.atomic():
+            paginate, _created = (
+                models.Paginate.objects.select_for_update()
+                .get_or_create(user_id=user_id)
+            )
+            merged = _get_rows_per_page_json(paginate)
+            merged.update(rows_per_page_json)
+            paginate.rows_per_page_json = merged
+            paginate.save(update_fields=['raw_rows_per_page'])
+
+    return len(rows_per_page_jsons)
+
+
+class Command(base.BaseCommand):
+    help = 'Copy stored rows per page between db_per_page_backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--to', choices=('json', 'normalized'),
+            default=settings['MODELS']['db_per_page_backend'],
+            help='Backend to copy to (default: the configured one)',
+        )
+
+    def handle(self, *args, **options):
+        if options['to'] == 'normalized':
+            users = _to_normalized()
+        else:
+            users = _to_json()
+
+        self.stdout.write(
+            'Copied rows per page of {} users to {}'.format(
+                users, options['to']
+            )
+        )
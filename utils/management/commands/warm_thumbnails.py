@@ -0,0 +1,102 @@
+# PSL
+import os
+import time
+import logging
+from concurrent import futures
+# 3rd Party
+import django
+from django import db
+from django.apps import apps
+from django.db import models
+from django.core.management import base
+# Local
+from ... import views, thumbnail_utils
+from ...conf import settings
+
+
+''' pregenerate thumbnails for every ImageField, e.g. after a bulk upload
+# only missing or outdated thumbnails are generated, so it can run from cron
+python manage.py warm_thumbnails --workers 4
+'''
+
+
+logger = logging.getLogger(__name__)
+
+GENERATED = 'generated'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+def _get_image_urls():
+    urls = set()  # multi-table inheritance repeats parent fields
+    for model in apps.get_models():
+        if model._meta.proxy:
+            continue
+        for field in model._meta.fields:
+            # same check as the is_image template filter
+            if not isinstance(field, models.ImageField):
+                continue
+            names = model._default_manager.exclude(
+                **{field.name: ''}
+            ).exclude(
+                **{field.name + '__isnull': True}
+            ).values_list(field.name, flat=True)
+            for name in names.iterator():
+                urls.add(field.storage.url(name))
+
+    return urls
+
+
+def _warm(job):
+    if not apps.ready:  # spawned rather than forked
+        django.setup()
+
+    url, width, height, fmt = job
+    try:
+        generated = views.generate_thumbnail(url, width, height, fmt=fmt)
+    except Exception:
+        logger.exception('Thumbnail generation failed for %s', url)
+        return FAILED
+
+    return GENERATED if generated else SKIPPED
+
+
+class Command(base.BaseCommand):
+    help = 'Pregenerate thumbnails for all ImageFields'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of worker processes (default: cpu count)',
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+
+        jobs = [
+            (url, width, height, fmt)
+            for url in sorted(_get_image_urls())
+            for width, height in settings['THUMBNAILS']['sizes']
+            for fmt in thumbnail_utils.get_formats()
+        ]
+
+        workers = options['workers'] or 1
+        if workers > 1:
+            # forked workers must not share the parent's db connections
+            db.connections.close_all()
+            with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    _warm, jobs, chunksize=max(1, len(jobs) // workers // 4)
+                ))
+        else:
+            results = [_warm(job) for job in jobs]
+
+        elapsed = time.time() - start
+        generated = results.count(GENERATED)
+        self.stdout.write(
+            '{} generated, {} skipped, {} failed in {:.1f}s'
+            ' ({:.1f} thumbnails/s)'.format(
+                generated, results.count(SKIPPED), results.count(FAILED),
+                elapsed, generated / elapsed if elapsed else 0,
+            )
+        )
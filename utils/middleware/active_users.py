@@ -1,10 +1,32 @@
+import datetime
+
+from django.contrib import auth
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
 from django.utils import timezone
 
+from utils import activity_utils
+from utils.conf import settings
+
 
 class ActiveUserMiddleware:
+    '''Keep request.user.last_active up to date.
+
+    Set UTILS['ACTIVE_USERS']['update_interval'] to only write when the
+    stored last_active is older than that many seconds, set buffer to leave
+    writing to activity_utils' periodic flush. With presence nothing is
+    written to the database, users are added to a redis sorted set.
+    User models without last_active are only added to the presence set.
+    '''
+
     def __init__(self, get_response):
         self.get_response = get_response
         # One-time configuration and initialization.
+        try:
+            auth.get_user_model()._meta.get_field('last_active')
+            self.has_last_active = True
+        except FieldDoesNotExist:
+            self.has_last_active = False
 
     def __call__(self, request):
         # Code to be executed for each request before
@@ -19,6 +41,21 @@ class ActiveUserMiddleware:
 
         return response
 
+    def should_update(self, user, now):
+        interval = settings['ACTIVE_USERS']['update_interval']
+        if not interval:
+            return True
+
+        last_active = getattr(user, 'last_active', None)
+        if last_active and now - last_active < datetime.timedelta(
+            seconds=interval
+        ):
+            return False
+
+        # only the first of concurrent requests writes
+        key = 'utils_last_active|{}'.format(user.pk)
+        return cache.add(key, True, interval)
+
     def update_user(self, request):
         user = request.user
         if isinstance(user.is_authenticated, bool):
@@ -26,5 +63,16 @@ class ActiveUserMiddleware:
         else:
             authenticated = user.is_authenticated()
         if authenticated:
-            user.last_active = timezone.now()
-            user.save()
+            now = timezone.now()
+            if settings['ACTIVE_USERS']['presence']:
+                activity_utils.add_presence(user.pk, now)
+                return
+            if not self.has_last_active:
+                return
+            if not self.should_update(user, now):
+                return
+            user.last_active = now
+            if settings['ACTIVE_USERS']['buffer']:
+                activity_utils.record(user.pk, now)
+            else:
+                user.save(update_fields=['last_active'])
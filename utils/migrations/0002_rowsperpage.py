@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:15
+from __future__ import unicode_literals
+
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_rows_per_page(apps, schema_editor):
+    Paginate = apps.get_model('utils', 'Paginate')
+    RowsPerPage = apps.get_model('utils', 'RowsPerPage')
+
+    rows = []
+    for paginate in Paginate.objects.all().iterator():
+        try:
+            rows_per_page_json = json.loads(paginate.raw_rows_per_page)
+        except ValueError:
+            continue
+        for rows_per_page_var, rows_per_page in rows_per_page_json.items():
+            try:
+                rows_per_page = int(rows_per_page)
+            except (TypeError, ValueError):
+                continue
+            if rows_per_page <= 0:
+                continue
+            rows.append(RowsPerPage(
+                user_id=paginate.user_id,
+                rows_per_page_var=rows_per_page_var[:255],
+                rows_per_page=rows_per_page,
+            ))
+
+    RowsPerPage.objects.bulk_create(rows, batch_size=1000)
+
+
+def copy_raw_rows_per_page(apps, schema_editor):
+    Paginate = apps.get_model('utils', 'Paginate')
+    RowsPerPage = apps.get_model('utils', 'RowsPerPage')
+
+    rows_per_page_jsons = {}
+    for row in RowsPerPage.objects.all().iterator():
+        rows_per_page_json = rows_per_page_jsons.setdefault(row.user_id, {})
+        rows_per_page_json[row.rows_per_page_var] = row.rows_per_page
+
+    # merged into existing blobs, which may be newer, their keys win
+    for user_id, rows_per_page_json in rows_per_page_jsons.items():
+        paginate, _created = Paginate.objects.get_or_create(user_id=user_id)
+        try:
+            rows_per_page_json.update(json.loads(paginate.raw_rows_per_page))
+        except ValueError:
+            pass
+        paginate.raw_rows_per_page = json.dumps(rows_per_page_json)
+        paginate.save(update_fields=['raw_rows_per_page'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('utils', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RowsPerPage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rows_per_page_var', models.CharField(max_length=255)),
+                ('rows_per_page', models.PositiveIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='rowsperpage',
+            unique_together=set([('user', 'rows_per_page_var')]),
+        ),
+        migrations.RunPython(copy_rows_per_page, copy_raw_rows_per_page),
+    ]
@@ -1,22 +1,113 @@
 import collections
+import collections.abc
+import itertools
 
 from django.db import models
+from django.db.models import signals
 from django.core.exceptions import ValidationError
 
 
 class FieldList:
     Field = collections.namedtuple('Field', ['field', 'value'])
 
+    class Fields(collections.abc.MutableMapping):
+        '''Field name to Field(field, value) mapping of get_all_fields.
+
+        Backed by the model's cached field metadata and a tuple of values,
+        copied to an OrderedDict on the first write so subclasses can still
+        add pseudo fields.
+        '''
+        __slots__ = ('_meta', '_values', '_dict')
+
+        def __init__(self, meta, values):
+            self._meta = meta  # get_field_list_meta
+            self._values = values
+            self._dict = None
+
+        def _get_dict(self):
+            if self._dict is None:
+                self._dict = collections.OrderedDict(self.items())
+            return self._dict
+
+        def __getitem__(self, name):
+            if self._dict is not None:
+                return self._dict[name]
+            _names, index, fields, _displays = self._meta
+            i = index[name]
+            return FieldList.Field(fields[i], self._values[i])
+
+        def __setitem__(self, name, value):
+            self._get_dict()[name] = value
+
+        def __delitem__(self, name):
+            del self._get_dict()[name]
+
+        def __iter__(self):
+            if self._dict is not None:
+                return iter(self._dict)
+            return iter(self._meta[0])
+
+        def __len__(self):
+            if self._dict is not None:
+                return len(self._dict)
+            return len(self._values)
+
+        def __getattr__(self, name):
+            # the rest of the OrderedDict api, e.g. move_to_end
+            if name.startswith('_'):
+                raise AttributeError(name)
+            return getattr(self._get_dict(), name)
+
+        def items(self):
+            if self._dict is not None:
+                return self._dict.items()
+            names, _index, fields, _displays = self._meta
+            # skips the namedtuple's python level __new__
+            return list(zip(names, map(
+                tuple.__new__, itertools.repeat(FieldList.Field),
+                zip(fields, self._values)
+            )))
+
+        def __repr__(self):
+            return '{}({!r})'.format(type(self).__name__, self.items())
+
+    @classmethod
+    def get_field_list_meta(cls):
+        '''Get the static part of get_all_fields, cached per model.
+
+        A tuple of (names, name to index, fields, display method names) for
+        editable fields, display method names are None without one.
+        '''
+        # not inherited, subclasses have their own fields
+        meta = cls.__dict__.get('_field_list_meta')
+        if meta is None:
+            fields = [f for f in cls._meta.fields if f.editable]
+            names = tuple(f.name for f in fields)
+            displays = []
+            for fname in names:
+                # resolve picklists/choices, with get_xyz_display() function
+                get_choice = 'get_' + fname + '_display'
+                if not hasattr(cls, get_choice):
+                    get_choice = None
+                displays.append(get_choice)
+            meta = (
+                names,
+                {fname: i for i, fname in enumerate(names)},
+                tuple(fields),
+                tuple(displays),
+            )
+            cls._field_list_meta = meta
+
+        return meta
+
     def get_all_fields(self):
-        """Returns a list of all field names on the instance."""
-
-        # use OrderedDict so we can look up values later on
-        fields = collections.OrderedDict()
-        for f in self._meta.fields:
-            fname = f.name
-            # resolve picklists/choices, with get_xyz_display() function
-            get_choice = 'get_' + fname + '_display'
-            if hasattr(self, get_choice):
+        """Returns a mapping of all field names on the instance."""
+        meta = self.get_field_list_meta()
+        names, _index, _fields, displays = meta
+
+        values = []
+        for fname, get_choice in zip(names, displays):
+            if get_choice is not None:
                 value = getattr(self, get_choice)()
             else:
                 try:
@@ -24,11 +115,9 @@ class FieldList:
                 except AttributeError:
                     # print("Could not get value of field.")
                     value = None
+            values.append(value)
 
-            if f.editable:
-                fields.update({f.name: self.Field(f, value)})
-
-        return fields
+        return self.Fields(meta, tuple(values))
 
     class PseudoField():
 
@@ -51,11 +140,63 @@ class FieldList:
 
 
 class ImageField(models.ImageField):
+    '''ImageField that deletes replaced files.
+
+    Set thumbnail_sizes, e.g. ((128, 128), (256, 256)), to generate those
+    thumbnails after save so get_thumbnail nearly always hits the cache.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.thumbnail_sizes = kwargs.pop('thumbnail_sizes', None)
+        super(ImageField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(ImageField, self).deconstruct()
+        if self.thumbnail_sizes:
+            kwargs['thumbnail_sizes'] = self.thumbnail_sizes
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(ImageField, self).contribute_to_class(cls, name, **kwargs)
+        # same as ImageField.update_dimension_fields on post_init
+        if self.thumbnail_sizes and not cls._meta.abstract:
+            signals.post_save.connect(self.generate_thumbnails, sender=cls)
+
+    def generate_thumbnails(self, instance, **kwargs):
+        from . import background_utils, thumbnail_utils, views
+        from .conf import settings
+
+        if kwargs.get('raw'):
+            return  # loaddata, the files may not even exist
+
+        file = getattr(instance, self.attname)
+        if not file:
+            return
+
+        for width, height in self.thumbnail_sizes:
+            for fmt in thumbnail_utils.get_formats():
+                background_utils.submit(
+                    'THUMBNAILS', 'background',
+                    views.generate_thumbnail, file.url, width, height,
+                    False, fmt,
+                    max_workers=settings['THUMBNAILS']['background_workers']
+                )
+
+    def delete_thumbnails(self, file):
+        from . import views
+        from .conf import settings
+
+        sizes = set(settings['THUMBNAILS']['sizes'])
+        sizes.update(self.thumbnail_sizes or ())
+        for width, height in sizes:
+            views.delete_thumbnail(file.url, width, height)
 
     def save_form_data(self, instance, data):
         if data is not None:
             file = getattr(instance, self.attname)
             if file != data:
+                if file:
+                    self.delete_thumbnails(file)
                 file.delete(save=False)
         super(ImageField, self).save_form_data(instance, data)
 
@@ -1,7 +1,10 @@
 import json
 
-from django.db import models
+from django.db import models, connections, router, transaction
 from django.conf import settings
+from django.core.cache import cache
+
+from utils.conf import settings as utils_settings
 
 
 class Paginate(models.Model):
@@ -21,3 +24,132 @@ class Paginate(models.Model):
     @rows_per_page_json.setter
     def rows_per_page_json(self, obj):
         self.raw_rows_per_page = json.dumps(obj)
+
+    @staticmethod
+    def get_cache_key(user_id):
+        return 'utils_paginate|{}'.format(user_id)
+
+    @staticmethod
+    def set_cached(user_id, rows_per_page_json):
+        # written through rather than deleted, readers only cache.add so a
+        #  read racing this write can't cache the old value
+        cache.set(
+            Paginate.get_cache_key(user_id), rows_per_page_json,
+            utils_settings['MODELS']['paginate_cache_timeout']
+        )
+
+    @classmethod
+    def set_rows_per_page(cls, user_id, rows_per_page_var, rows_per_page):
+        '''Set a single rows per page value, creating the row if needed.
+
+        On postgres this is one INSERT ... ON CONFLICT merging the key into
+        the stored json, elsewhere the row is locked and only
+        raw_rows_per_page is written.
+        '''
+        using = router.db_for_write(cls)
+        connection = connections[using]
+        raw_rows_per_page = json.dumps({rows_per_page_var: rows_per_page})
+
+        if connection.vendor == 'postgresql':
+            quote_name = connection.ops.quote_name
+            table = quote_name(cls._meta.db_table)
+            user = quote_name(cls._meta.get_field('user').column)
+            raw = quote_name(cls._meta.get_field('raw_rows_per_page').column)
+            sql = (
+                'INSERT INTO {table} ({user}, {raw}) VALUES (%s, %s)'
+                ' ON CONFLICT ({user}) DO UPDATE SET {raw} = ('
+                "COALESCE(NULLIF({table}.{raw}, ''), '{{}}')::jsonb"
+                ' || EXCLUDED.{raw}::jsonb'
+                ')::text'
+                ' RETURNING {raw}'
+            ).format(table=table, user=user, raw=raw)
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [user_id, raw_rows_per_page])
+                rows_per_page_json = json.loads(cursor.fetchone()[0])
+        else:
+            with transaction.atomic(using=using):
+                paginate, created = (
+                    cls.objects.using(using).select_for_update()
+                    .get_or_create(
+                        user_id=user_id,
+                        defaults={'raw_rows_per_page': raw_rows_per_page},
+                    )
+                )
+                rows_per_page_json = paginate.rows_per_page_json
+                if not created:
+                    rows_per_page_json[rows_per_page_var] = rows_per_page
+                    paginate.rows_per_page_json = rows_per_page_json
+                    paginate.save(update_fields=['raw_rows_per_page'])
+
+        cls.set_cached(user_id, rows_per_page_json)
+
+    @classmethod
+    def get_rows_per_page_json(cls, user_id):
+        try:
+            paginate = cls.objects.get(user_id=user_id)
+        except cls.DoesNotExist:
+            return {}
+
+        return paginate.rows_per_page_json
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        cache.delete(self.get_cache_key(self.user_id))
+
+    def delete(self, *args, **kwargs):
+        cache.delete(self.get_cache_key(self.user_id))
+        return super().delete(*args, **kwargs)
+
+
+class RowsPerPage(models.Model):
+    '''Normalized alternative to Paginate, one row per user and table.
+
+    Used when UTILS['MODELS']['db_per_page_backend'] is 'normalized'.
+    '''
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+
+    rows_per_page_var = models.CharField(max_length=255)
+    rows_per_page = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('user', 'rows_per_page_var')
+
+    @staticmethod
+    def get_cache_key(user_id):
+        # not Paginate's, after switching backends its values aren't served
+        return 'utils_rows_per_page|{}'.format(user_id)
+
+    @staticmethod
+    def set_cached(user_id, rows_per_page_json):
+        cache.set(
+            RowsPerPage.get_cache_key(user_id), rows_per_page_json,
+            utils_settings['MODELS']['paginate_cache_timeout']
+        )
+
+    @classmethod
+    def get_rows_per_page_json(cls, user_id):
+        return dict(
+            cls.objects.filter(user_id=user_id).values_list(
+                'rows_per_page_var', 'rows_per_page'
+            )
+        )
+
+    @classmethod
+    def set_rows_per_page(cls, user_id, rows_per_page_var, rows_per_page):
+        cls.objects.update_or_create(
+            user_id=user_id,
+            rows_per_page_var=rows_per_page_var,
+            defaults={'rows_per_page': rows_per_page},
+        )
+
+        cls.set_cached(user_id, cls.get_rows_per_page_json(user_id))
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        cache.delete(self.get_cache_key(self.user_id))
+
+    def delete(self, *args, **kwargs):
+        cache.delete(self.get_cache_key(self.user_id))
+        return super().delete(*args, **kwargs)
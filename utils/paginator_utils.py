@@ -0,0 +1,253 @@
+import json
+import hashlib
+
+from django.core import paginator
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.utils.functional import cached_property
+
+from utils import background_utils
+from utils.conf import settings
+
+
+EXACT = 'exact'
+CACHED = 'cached'
+ESTIMATE = 'estimate'
+PROBE = 'probe'
+
+
+def _exact_count(object_list):
+    # same as Paginator.count
+    try:
+        return object_list.count()
+    except (AttributeError, TypeError):
+        return len(object_list)
+
+
+def _get_query_digest(object_list):
+    # None if object_list isn't a queryset
+    try:
+        sql, params = object_list.query.sql_with_params()
+    except (AttributeError, EmptyResultSet):
+        return None
+
+    key = '{}|{!r}|{}'.format(sql, params, object_list.db)
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class CachedCountPaginator(paginator.Paginator):
+    '''Paginator caching counts by the query's SQL and params.'''
+    is_estimate = False
+
+    def get_cache_key(self):
+        digest = _get_query_digest(self.object_list)
+        if digest is None:
+            return None
+
+        return 'utils_count|{}'.format(digest)
+
+    @cached_property
+    def count(self):
+        key = self.get_cache_key()
+        if key is None:
+            return _exact_count(self.object_list)
+
+        count = cache.get(key)
+        if count is None:
+            count = _exact_count(self.object_list)
+            cache.set(key, count, settings['MODELS']['count_cache_timeout'])
+
+        return count
+
+
+class EstimatedCountPaginator(paginator.Paginator):
+    '''Paginator using the postgres planner's row estimate on large tables.
+
+    Counts are exact below count_estimate_threshold rows and on other
+    backends.
+    '''
+    is_estimate = False
+
+    def get_estimate(self):
+        queryset = self.object_list
+        try:
+            connection = connections[queryset.db]
+            if connection.vendor != 'postgresql':
+                return None
+            sql, params = queryset.query.sql_with_params()
+        except (AttributeError, EmptyResultSet):
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @cached_property
+    def count(self):
+        estimate = self.get_estimate()
+        threshold = settings['MODELS']['count_estimate_threshold']
+        if estimate is None or estimate < threshold:
+            return _exact_count(self.object_list)
+
+        self.is_estimate = True
+        return estimate
+
+
+class ProbePaginator(paginator.Paginator):
+    '''Paginator that fetches per_page + 1 rows instead of counting.
+
+    count is a lower bound until the last page is reached, enough for
+    has_next/has_previous. Only an out of range page falls back to counting.
+    '''
+    is_estimate = True
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise paginator.PageNotAnInteger(
+                'That page number is not an integer'
+            )
+        if number < 1:
+            raise paginator.EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page + 1  # probe
+        object_list = list(self.object_list[bottom:top])
+        has_next = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if not object_list and number > 1:
+            raise paginator.EmptyPage('That page contains no results')
+
+        self.__dict__.pop('num_pages', None)
+        self.count = bottom + len(object_list) + int(has_next)
+        self.is_estimate = has_next
+
+        return self._get_page(object_list, number, self)
+
+    @cached_property
+    def count(self):
+        # only reached before a page has been fetched
+        self.is_estimate = False
+        return _exact_count(self.object_list)
+
+
+class PrefetchNextMixin:
+    '''Paginator mixin warming the next page's pks into django's cache.
+
+    After a page is served the next page's primary keys are fetched in the
+    background and kept for prefetch_next_timeout seconds, that page is then
+    fetched by pk instead of rerunning a slow filtered/ordered query.
+    '''
+
+    def get_page_cache_key(self, number):
+        digest = _get_query_digest(self.object_list)
+        if digest is None:
+            return None
+
+        return 'utils_page|{}|{}|{}|{}'.format(
+            digest, self.per_page, self.orphans, number
+        )
+
+    def get_bounds(self, number):
+        # same as Paginator.page
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        return bottom, top
+
+    def warm(self, number):
+        key = self.get_page_cache_key(number)
+        try:
+            bottom, top = self.get_bounds(number)
+            pks = list(
+                self.object_list.values_list('pk', flat=True)[bottom:top]
+            )
+            cache.set(key, pks, settings['MODELS']['prefetch_next_timeout'])
+        finally:
+            cache.delete(key + '|pending')
+
+    def submit_warm(self, number):
+        '''Warm page number in the background unless it's cached or pending.
+
+        Jobs beyond prefetch_next_max_pending are dropped.
+        '''
+        key = self.get_page_cache_key(number)
+        timeout = settings['MODELS']['prefetch_next_timeout']
+        if cache.get(key) is not None:
+            return
+        if not cache.add(key + '|pending', True, timeout):
+            return
+
+        submitted = background_utils.submit(
+            'MODELS', 'prefetch_next_background', self.warm, number,
+            max_pending=settings['MODELS']['prefetch_next_max_pending']
+        )
+        if not submitted:
+            cache.delete(key + '|pending')
+
+    def get_by_pks(self, pks):
+        objects = self.object_list.filter(pk__in=pks).order_by()
+        objects_by_pk = {obj.pk: obj for obj in objects}
+        return [objects_by_pk[pk] for pk in pks if pk in objects_by_pk]
+
+    def page(self, number):
+        number = self.validate_number(number)
+        key = self.get_page_cache_key(number)
+        if key is None:
+            return super().page(number)
+
+        pks = cache.get(key)
+        if pks is None:
+            page = super().page(number)
+        else:
+            page = self._get_page(self.get_by_pks(pks), number, self)
+
+        if page.has_next():
+            self.submit_warm(number + 1)
+
+        return page
+
+
+PAGINATORS = {
+    EXACT: paginator.Paginator,
+    CACHED: CachedCountPaginator,
+    ESTIMATE: EstimatedCountPaginator,
+    PROBE: ProbePaginator,
+}
+
+
+_prefetch_next_classes = {}
+
+
+def get_paginator_class(count=None, prefetch_next=False):
+    '''Get the paginator for a counting strategy name or paginator class.
+
+    Defaults to UTILS['MODELS']['paginate_count']. With prefetch_next the
+    paginator warms the next page, except with probe which already avoids
+    the count and learns has_next from the page query itself.
+    '''
+    if count is None:
+        count = settings['MODELS']['paginate_count']
+    if isinstance(count, str):
+        count = PAGINATORS[count]
+
+    if not prefetch_next or issubclass(count, ProbePaginator):
+        return count
+
+    if count not in _prefetch_next_classes:
+        _prefetch_next_classes[count] = type(
+            'PrefetchNext' + count.__name__, (PrefetchNextMixin, count), {}
+        )
+
+    return _prefetch_next_classes[count]
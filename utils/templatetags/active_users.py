@@ -1,19 +1,25 @@
+import time
 from datetime import datetime, timedelta
 
+from django.contrib import auth
 from django.contrib.sessions.models import Session
-from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
 from django.utils import timezone
 
 from django import template
 
+from utils import activity_utils
+from utils.conf import settings
+
 
 register = template.Library()
 if not hasattr(register, 'assignment_tag'):
     register.assignment_tag = register.simple_tag
 
 
-@register.assignment_tag
-def get_active_users():
+def _get_session_active_users(User, since):
+    # without last_active, decodes every session
     now = timezone.now()
     sessions = Session.objects.filter(expire_date__gte=now)
     uids = []
@@ -27,8 +33,58 @@ def get_active_users():
         last_logged_in = datetime.fromtimestamp(
             last_logged_in_seconds, tz=now.tzinfo
         )
-        # active in the last 10 minutes
-        if last_logged_in > (now - timedelta(minutes=10)):
+        if last_logged_in > since:
             uids.append(data.get('_auth_user_id', None))
 
-    return User.objects.filter(id__in=uids)
+    return User._default_manager.filter(id__in=uids)
+
+
+def _get_active_users(User):
+    since = timezone.now() - timedelta(
+        seconds=settings['ACTIVE_USERS']['window']
+    )
+
+    if settings['ACTIVE_USERS']['presence']:
+        user_ids = activity_utils.get_present_user_ids(since)
+        return User._default_manager.filter(pk__in=user_ids)
+
+    try:
+        User._meta.get_field('last_active')
+    except FieldDoesNotExist:
+        return _get_session_active_users(User, since)
+
+    return User._default_manager.filter(last_active__gt=since)
+
+
+def _get_cache_key(bucket):
+    return 'utils_active_users|{}'.format(bucket)
+
+
+@register.assignment_tag
+def get_active_users():
+    '''Users active in the last UTILS['ACTIVE_USERS']['window'] seconds.
+
+    Uses the presence sorted set or the user model's last_active, kept by
+    ActiveUserMiddleware. Their pks are cached per cache_timeout seconds
+    bucket, while one worker recomputes an expired bucket the others serve
+    the previous one.
+    '''
+    User = auth.get_user_model()
+    timeout = settings['ACTIVE_USERS']['cache_timeout']
+    if not timeout:
+        return _get_active_users(User)
+
+    bucket = int(time.time() // timeout)
+    key = _get_cache_key(bucket)
+    user_ids = cache.get(key)
+    if user_ids is None:
+        if not cache.add(key + '|lock', True, timeout):
+            user_ids = cache.get(_get_cache_key(bucket - 1))
+        if user_ids is None:
+            user_ids = list(
+                _get_active_users(User).values_list('pk', flat=True)
+            )
+            # kept for a second bucket, served while the next recomputes
+            cache.set(key, user_ids, timeout * 2)
+
+    return User._default_manager.filter(pk__in=user_ids)
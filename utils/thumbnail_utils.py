@@ -0,0 +1,371 @@
+# PSL
+import os
+import time
+import datetime
+import hashlib
+import threading
+import contextlib
+from concurrent import futures
+# 3rd Party
+from django import http
+from django.core.files import base, storage as files_storage
+from django.utils import module_loading
+# Local
+from . import background_utils
+from .conf import settings
+
+
+JPEG = 'jpeg'
+WEBP = 'webp'
+AVIF = 'avif'
+# format: (PIL format, content type, extension)
+FORMATS = {
+    JPEG: ('JPEG', 'image/jpeg', 'jpg'),
+    WEBP: ('WEBP', 'image/webp', 'webp'),
+    AVIF: ('AVIF', 'image/avif', 'avif'),
+}
+
+_storage = None
+_last_sweep = 0
+_async_executor_lock = threading.Lock()
+_async_executor = None
+_decode_semaphore = None
+_decode_semaphore_lock = threading.Lock()
+
+# 1x1 transparent gif
+PLACEHOLDER = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+    b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+    b'\x01\x00;'
+)
+PLACEHOLDER_CONTENT_TYPE = 'image/gif'
+
+
+class OverBudget(Exception):
+    '''Thumbnail exceeds the pixel or concurrency budget.'''
+
+
+def get_storage():
+    '''Get the storage thumbnails are cached in.
+
+    Defaults to a FileSystemStorage under MEDIA_ROOT.
+    '''
+    global _storage
+
+    if _storage is None:
+        storage_path = settings['THUMBNAILS']['storage']
+        if storage_path:
+            _storage = module_loading.import_string(storage_path)()
+        else:
+            _storage = files_storage.FileSystemStorage()
+
+    return _storage
+
+
+def is_supported(fmt):
+    '''Check if the installed Pillow can encode fmt.'''
+    from PIL import Image
+
+    Image.init()
+
+    return FORMATS[fmt][0] in Image.SAVE
+
+
+def get_formats():
+    '''Get all formats thumbnails may be served in, JPEG first.'''
+    return [JPEG] + [
+        fmt for fmt in settings['THUMBNAILS']['formats']
+        if fmt != JPEG and is_supported(fmt)
+    ]
+
+
+def get_format(request):
+    '''Negotiate the thumbnail format from the Accept header.
+
+    The first UTILS['THUMBNAILS']['formats'] entry the client accepts and
+    Pillow can encode is used, JPEG otherwise.
+    '''
+    accepted = set()
+    for media_range in request.META.get('HTTP_ACCEPT', '').split(','):
+        params = [param.strip() for param in media_range.split(';')]
+        if 'q=0' in params or 'q=0.0' in params:
+            continue
+        accepted.add(params[0].lower())
+
+    for fmt in get_formats()[1:]:
+        if FORMATS[fmt][1] in accepted:
+            return fmt
+
+    return JPEG
+
+
+def get_content_type(fmt):
+    return FORMATS[fmt][1]
+
+
+def is_valid_size(width, height):
+    '''Check requested dimensions against UTILS['THUMBNAILS']['max_size'].'''
+    max_size = settings['THUMBNAILS']['max_size']
+    try:
+        return 0 < int(width) <= max_size and 0 < int(height) <= max_size
+    except (TypeError, ValueError):
+        return False
+
+
+def check_pixels(img):
+    '''Raise OverBudget if img would decode to more than max_pixels.
+
+    Only the header has been read at this point, call after Image.draft.
+    '''
+    max_pixels = settings['THUMBNAILS']['max_pixels']
+    if max_pixels and img.size[0] * img.size[1] > max_pixels:
+        raise OverBudget(
+            '{}x{} exceeds {} pixels'.format(img.size[0], img.size[1],
+                                             max_pixels)
+        )
+
+
+@contextlib.contextmanager
+def decode_slot():
+    '''Limit concurrent decodes in this process.
+
+    Waits up to concurrency_timeout seconds for a slot, then raises
+    OverBudget.
+    '''
+    global _decode_semaphore
+
+    limit = settings['THUMBNAILS']['max_concurrency']
+    if not limit:
+        yield
+        return
+
+    with _decode_semaphore_lock:
+        if _decode_semaphore is None:
+            _decode_semaphore = threading.BoundedSemaphore(limit)
+
+    timeout = settings['THUMBNAILS']['concurrency_timeout']
+    if not _decode_semaphore.acquire(timeout=timeout):
+        raise OverBudget('No decode slot within {}s'.format(timeout))
+    try:
+        yield
+    finally:
+        _decode_semaphore.release()
+
+
+def get_key(path, width, height, force=False, fmt=JPEG):
+    '''Get the key of a thumbnail, None if the source is missing.
+
+    The key is content addressed, it changes when the source is modified
+    (mtime/size) or a different geometry or format is requested.
+    '''
+    try:
+        stat = os.stat(path)
+        key = '{}|{}|{}|{}|{}|{}|{}'.format(
+            path, stat.st_mtime_ns, stat.st_size,
+            int(width), int(height), force, fmt
+        )
+    except (OSError, TypeError, ValueError):
+        return None
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_etag(path, width, height, force=False, fmt=JPEG):
+    '''Get a strong ETag for a thumbnail.'''
+    return get_key(path, width, height, force=force, fmt=fmt)
+
+
+def get_last_modified(path):
+    '''Get the last modified datetime (UTC) of a thumbnail's source.'''
+    try:
+        return datetime.datetime.utcfromtimestamp(os.path.getmtime(path))
+    except OSError:
+        return None
+
+
+def get_cache_name(path, width, height, force=False, fmt=JPEG):
+    '''Get the cache name of a thumbnail.
+
+    Stale entries are never served as the name changes with the source,
+    they are left for sweep_cache to evict.
+    '''
+    if not settings['THUMBNAILS']['cache']:
+        return None
+
+    key = get_key(path, width, height, force=force, fmt=fmt)
+    if key is None:
+        return None
+
+    return '{}/{}/{}.{}'.format(
+        settings['THUMBNAILS']['cache_dir'], key[:2], key, FORMATS[fmt][2]
+    )
+
+
+def _touch(storage, name):
+    # bump the modified time so the sweep evicts least recently used first
+    try:
+        os.utime(storage.path(name))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def is_cached(name):
+    '''Check if a thumbnail is cached.'''
+    if name is None:
+        return False
+
+    return get_storage().exists(name)
+
+
+def get_cached_response(name, content_type='image/jpeg'):
+    '''Get a response serving a cached thumbnail, None on a miss.
+
+    The thumbnail is never read into memory, it is streamed with a
+    FileResponse (wsgi.file_wrapper/sendfile where available) or handed off
+    to the web server with X-Sendfile/X-Accel-Redirect.
+    '''
+    if name is None:
+        return None
+
+    storage = get_storage()
+    serve = settings['THUMBNAILS']['serve']
+    if serve == 'file':
+        try:
+            _file = storage.open(name)
+        except (IOError, OSError):
+            return None
+        response = http.FileResponse(_file, content_type=content_type)
+    else:
+        if not storage.exists(name):
+            return None
+        response = http.HttpResponse(content_type=content_type)
+        if serve == 'x-sendfile':
+            response['X-Sendfile'] = storage.path(name)
+        else:  # x-accel-redirect
+            prefix = settings['THUMBNAILS']['x_accel_redirect_prefix']
+            if prefix:
+                response['X-Accel-Redirect'] = prefix + name
+            else:
+                response['X-Accel-Redirect'] = storage.url(name)
+
+    _touch(storage, name)
+
+    return response
+
+
+def delete_cached(name):
+    '''Delete a cached thumbnail.'''
+    if name is None:
+        return
+
+    get_storage().delete(name)
+
+
+def set_cached(name, data):
+    '''Cache thumbnail data, periodically sweeping the cache.'''
+    if name is None or data is None:
+        return
+
+    storage = get_storage()
+    if not storage.exists(name):
+        try:
+            path = storage.path(name)
+        except NotImplementedError:
+            path = None
+
+        if path is None:
+            # remote storages only expose an object once it is uploaded
+            saved_name = storage.save(name, base.ContentFile(data))
+            if saved_name != name:
+                # lost a race with another worker, keep theirs
+                storage.delete(saved_name)
+        else:
+            # storage.save creates name before writing to it, a concurrent
+            #  hit could serve a partial thumbnail, write next to it first
+            temp_name = storage.save(name + '.tmp', base.ContentFile(data))
+            try:
+                os.replace(storage.path(temp_name), path)
+            except OSError:
+                storage.delete(temp_name)
+
+    _maybe_sweep()
+
+
+def _get_modified_time(storage, name):
+    if hasattr(storage, 'get_modified_time'):
+        return storage.get_modified_time(name)
+    return storage.modified_time(name)  # django <= 1.9 compat
+
+
+def _maybe_sweep():
+    global _last_sweep
+
+    now = time.time()
+    if now - _last_sweep < settings['THUMBNAILS']['cache_sweep_interval']:
+        return
+    _last_sweep = now
+
+    # lists and stats the whole cache, kept off the request path
+    background_utils.submit(
+        'THUMBNAILS', 'background', sweep_cache,
+        max_workers=settings['THUMBNAILS']['background_workers']
+    )
+
+
+def sweep_cache(max_size=None):
+    '''Evict least recently used thumbnails until under max_size bytes.
+
+    Returns the number of thumbnails deleted.
+    '''
+    if max_size is None:
+        max_size = settings['THUMBNAILS']['cache_max_size']
+
+    storage = get_storage()
+    cache_dir = settings['THUMBNAILS']['cache_dir']
+
+    try:
+        dirs, _files = storage.listdir(cache_dir)
+    except (IOError, OSError):
+        return 0  # nothing cached yet
+
+    entries = []
+    total_size = 0
+    for _dir in dirs:
+        dir_name = '{}/{}'.format(cache_dir, _dir)
+        for filename in storage.listdir(dir_name)[1]:
+            name = '{}/{}'.format(dir_name, filename)
+            try:
+                size = storage.size(name)
+                modified_time = _get_modified_time(storage, name)
+            except (IOError, OSError):
+                continue  # deleted by another worker
+            entries.append((modified_time, size, name))
+            total_size += size
+
+    deleted = 0
+    entries.sort()
+    for _modified_time, size, name in entries:
+        if total_size <= max_size:
+            break
+        storage.delete(name)
+        total_size -= size
+        deleted += 1
+
+    return deleted
+
+
+def get_async_executor():
+    '''Get the bounded executor get_thumbnail_async renders misses in.
+
+    Kept apart from the sync_to_async thread pool so resizing cannot starve
+    other views.
+    '''
+    global _async_executor
+
+    with _async_executor_lock:
+        if _async_executor is None:
+            _async_executor = futures.ThreadPoolExecutor(
+                max_workers=settings['THUMBNAILS']['async_workers']
+            )
+
+    return _async_executor
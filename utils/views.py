@@ -9,102 +9,97 @@ from django import http, template
 from django.template import loader
 from django.views.generic import edit
 from django.forms import models
-from django.views.decorators import csrf
+from django.views.decorators import csrf, http as http_decorators
+from django.utils import cache
 from django.core import mail
 from django.contrib.auth import decorators
 # Local
-from . import utils
+from . import utils, thumbnail_utils
+from .conf import settings as utils_settings
 
 
-def _get_exif(filename):
-    import piexif
-    # from PIL.ExifTags import TAGS
+EXIF_ORIENTATION = 0x0112
 
-    orientation = None
-    exif_bytes = None
 
-    # exifinfo = img._getexif()
-    # if exifinfo is not None:
-    #     ret = {}
-    #     for tag, value in exifinfo.items():
-    #         decoded = TAGS.get(tag, tag)
-    #         ret[decoded] = value
-    #     for k, v in ret.items():
-    #         if k == "Orientation":
-    #             orientation = v
+def _reduce(img, size, reducing_gap):
+    # cheap integer box reduction down to reducing_gap times the final size,
+    #  the final resample then only has to work on a small bitmap
+    if not reducing_gap or not hasattr(img, 'reduce'):  # pillow < 7 compat
+        return img
 
-    try:
-        exif_dict = piexif.load(filename)
-
-        zeroth = '0th'
-        exif = 'Exif'
-        gps = 'GPS'
+    factor = int(min(
+        img.width / (size[0] * reducing_gap),
+        img.height / (size[1] * reducing_gap),
+    ))
+    if factor > 1:
+        img = img.reduce(factor)
 
-        zeroth_ifd = exif_dict[zeroth]
-        exif_ifd = exif_dict[exif]
-        gps_ifd = exif_dict[gps]
+    return img
 
-        if piexif.ImageIFD.Orientation in zeroth_ifd:
-            orientation = zeroth_ifd.pop(piexif.ImageIFD.Orientation)
-            new_exif_dict = {zeroth: zeroth_ifd, exif: exif_ifd, gps: gps_ifd}
-            exif_bytes = piexif.dump(new_exif_dict)
-    except ValueError:  # Given file is niether JPEG nor TIFF.
-        orientation = None
-        exif_bytes = None
 
-    return orientation, exif_bytes
+def _get_save_kwargs(fmt):
+    thumbnail_settings = utils_settings['THUMBNAILS']
+    kwargs = {}
+    quality = thumbnail_settings['quality'].get(fmt)
+    if quality is not None:
+        kwargs['quality'] = quality
+    if fmt == thumbnail_utils.JPEG:
+        kwargs['progressive'] = thumbnail_settings['progressive']
+        kwargs['optimize'] = thumbnail_settings['optimize']
 
+    return kwargs
 
-def _update_orientation(img, orientation):
-    from PIL import Image
 
-    if orientation == 2:
-        img = img.transpose(Image.FLIP_LEFT_RIGHT)
-    elif orientation == 3:
-        img = img.rotate(180)
-    elif orientation == 4:
-        img = img.rotate(180).transpose(Image.FLIP_LEFT_RIGHT)
-    elif orientation == 5:
-        img = img.rotate(-90).transpose(Image.FLIP_LEFT_RIGHT)
-    elif orientation == 6:
-        img = img.rotate(-90)
-    elif orientation == 7:
-        img = img.rotate(90).transpose(Image.FLIP_LEFT_RIGHT)
-    elif orientation == 8:
-        img = img.rotate(90)
+def _rescale(input_file, width, height, force=True,
+             fmt=thumbnail_utils.JPEG):
+    try:
+        max_width = int(width)
+        max_height = int(height)
+    except TypeError:
+        return None
+    size = (max_width, max_height)
 
-    return img
+    with thumbnail_utils.decode_slot():
+        return _rescale_image(input_file, size, force, fmt)
 
 
-def _rescale(input_file, width, height, force=True):
+def _rescale_image(input_file, size, force, fmt):
     from PIL import Image
     from PIL import ImageOps
     from io import BytesIO
 
-    try:
-        max_width = int(width)
-        max_height = int(height)
-    except TypeError:
-        return None
-
     img = Image.open(input_file)
+    if utils_settings['THUMBNAILS']['draft']:
+        # jpegs are decoded with DCT scaling at the nearest power of two
+        #  scale that is still larger than size
+        img.draft(img.mode, size)
+    try:
+        thumbnail_utils.check_pixels(img)
+    except thumbnail_utils.OverBudget:
+        img.close()
+        raise
+    if utils_settings['THUMBNAILS']['draft']:
+        img = _reduce(img, size, utils_settings['THUMBNAILS']['reducing_gap'])
+    # orientation is read from the already open image, the output is then
+    #  upright and carries no exif
+    if img.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        img = ImageOps.exif_transpose(img)
     if not force:
-        img.thumbnail((max_width, max_height), Image.ANTIALIAS)
+        img.thumbnail(size, Image.LANCZOS)
     else:
-        img = ImageOps.fit(img, (max_width, max_height,),
-                           method=Image.ANTIALIAS)
+        img = ImageOps.fit(img, size, method=Image.LANCZOS)
 
-    tmp = BytesIO()
-    orientation, exif_bytes = _get_exif(input_file)
-    if orientation:
-        img = _update_orientation(img, orientation)
-        img.save(tmp, 'JPEG', exif=exif_bytes)
+    if fmt == thumbnail_utils.JPEG:
+        mode = 'RGB'
     else:
-        if img.mode != 'RGB':
-            img.convert('RGB').save(tmp, 'JPEG')
-        else:
-            img.save(tmp, 'JPEG')
-    tmp.seek(0)
+        # webp/avif keep transparency
+        has_alpha = 'A' in img.mode or 'transparency' in img.info
+        mode = 'RGBA' if has_alpha else 'RGB'
+    if img.mode != mode:
+        img = img.convert(mode)
+
+    tmp = BytesIO()
+    img.save(tmp, thumbnail_utils.FORMATS[fmt][0], **_get_save_kwargs(fmt))
     output_data = tmp.getvalue()
     img.close()
     tmp.close()
@@ -112,21 +107,131 @@ def _rescale(input_file, width, height, force=True):
     return output_data
 
 
-def get_thumbnail(request, width, height, url):
+def _get_media_path(url):
     decoded_url = urllib.parse.unquote(url)
     media_root = settings.MEDIA_ROOT
     media_url = settings.MEDIA_URL
     partial_path = decoded_url.replace(media_url, "")
     path = os.path.join(media_root, partial_path)
+
+    return path
+
+
+def _placeholder():
+    # never cached so the real thumbnail is fetched next time
+    response = http.HttpResponse(
+        thumbnail_utils.PLACEHOLDER, thumbnail_utils.PLACEHOLDER_CONTENT_TYPE
+    )
+    cache.add_never_cache_headers(response)
+
+    return response
+
+
+def _thumbnail_etag(request, width, height, url):
+    return thumbnail_utils.get_etag(
+        _get_media_path(url), width, height, force=False,
+        fmt=thumbnail_utils.get_format(request)
+    )
+
+
+def _thumbnail_last_modified(request, width, height, url):
+    return thumbnail_utils.get_last_modified(_get_media_path(url))
+
+
+def _render_thumbnail(path, width, height, fmt, cache_name):
+    thumbnail = _rescale(path, width, height, force=False, fmt=fmt)
+    thumbnail_utils.set_cached(cache_name, thumbnail)
+
+    return thumbnail
+
+
+def _patch_thumbnail_headers(response):
+    cache.patch_cache_control(
+        response, max_age=utils_settings['THUMBNAILS']['max_age']
+    )
+    cache.patch_vary_headers(response, ('Accept',))
+
+
+# 304s are returned before any decoding
+@http_decorators.condition(
+    etag_func=_thumbnail_etag, last_modified_func=_thumbnail_last_modified
+)
+def _get_thumbnail(request, width, height, url):
+    path = _get_media_path(url)
+    fmt = thumbnail_utils.get_format(request)
+    content_type = thumbnail_utils.get_content_type(fmt)
+    response = None
     thumbnail = None
     if os.path.isfile(path):
-        thumbnail = _rescale(path, width, height, force=False)
+        cache_name = thumbnail_utils.get_cache_name(
+            path, width, height, force=False, fmt=fmt
+        )
+        response = thumbnail_utils.get_cached_response(
+            cache_name, content_type
+        )
+        if response is None:
+            thumbnail = _render_thumbnail(
+                path, width, height, fmt, cache_name
+            )
+
+    if response is None:
+        response = http.HttpResponse(thumbnail, content_type)
+        if thumbnail is None:
+            return response
 
-    response = http.HttpResponse(thumbnail, 'image/jpeg')
+    _patch_thumbnail_headers(response)
 
     return response
 
 
+def get_thumbnail(request, width, height, url):
+    # checked outside _get_thumbnail so the 400 and placeholder don't carry
+    #  the real thumbnail's ETag/Last-Modified
+    if not thumbnail_utils.is_valid_size(width, height):
+        return http.HttpResponseBadRequest()
+
+    try:
+        return _get_thumbnail(request, width, height, url)
+    except thumbnail_utils.OverBudget:
+        return _placeholder()
+
+
+def generate_thumbnail(url, width, height, force=False,
+                       fmt=thumbnail_utils.JPEG):
+    '''Generate a thumbnail into the cache as get_thumbnail would.
+
+    Returns True if a thumbnail was generated, False if it was already cached
+    or the source is missing.
+    '''
+    path = _get_media_path(url)
+    if not os.path.isfile(path):
+        return False
+
+    cache_name = thumbnail_utils.get_cache_name(
+        path, width, height, force=force, fmt=fmt
+    )
+    if cache_name is None or thumbnail_utils.is_cached(cache_name):
+        return False
+
+    thumbnail_utils.set_cached(
+        cache_name, _rescale(path, width, height, force=force, fmt=fmt)
+    )
+
+    return True
+
+
+def delete_thumbnail(url, width, height, force=False):
+    '''Delete cached thumbnails in all formats.
+
+    Call before the source is deleted.
+    '''
+    path = _get_media_path(url)
+    for fmt in thumbnail_utils.FORMATS:
+        thumbnail_utils.delete_cached(thumbnail_utils.get_cache_name(
+            path, width, height, force=force, fmt=fmt
+        ))
+
+
 class FormsetUpdateView(edit.UpdateView):
     can_delete = False
 
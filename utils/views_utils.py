@@ -1,34 +1,96 @@
+import collections.abc
+
 from django import shortcuts, http
 from django.contrib import messages
-from django.core import paginator
+from django.core import paginator, signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models as db_models
+from django.core.cache import cache
 
-from utils import models
+from utils import models, paginator_utils
 from utils.conf import settings
 from utils.forms import form_utils
 
 
+def _get_per_page_model():
+    if settings['MODELS']['db_per_page_backend'] == 'normalized':
+        return models.RowsPerPage
+    return models.Paginate
+
+
+def _get_rows_per_page_json(request):
+    '''Get the user's stored rows per page.
+
+    Loaded at most once per request and kept in django's cache,
+    set_rows_per_page writes through it and saves invalidate it.
+    '''
+    if not hasattr(request, '_rows_per_page_json'):
+        user_id = request.user.pk
+        model = _get_per_page_model()
+        key = model.get_cache_key(user_id)
+        rows_per_page_json = cache.get(key)
+        if rows_per_page_json is None:
+            rows_per_page_json = model.get_rows_per_page_json(user_id)
+            # add, a write since our read has already cached its value
+            cache.add(
+                key, rows_per_page_json,
+                settings['MODELS']['paginate_cache_timeout']
+            )
+        request._rows_per_page_json = rows_per_page_json
+
+    return request._rows_per_page_json
+
+
+def _set_rows_per_page(request, rows_per_page_var, paginate_by):
+    _get_per_page_model().set_rows_per_page(
+        request.user.pk, rows_per_page_var, paginate_by
+    )
+
+    rows_per_page_json = dict(_get_rows_per_page_json(request))
+    rows_per_page_json[rows_per_page_var] = paginate_by
+    request._rows_per_page_json = rows_per_page_json
+
+
+def _clean_rows_per_page(rows_per_page):
+    '''Coerce rows per page to an allowed int, None if invalid.
+
+    Values above UTILS['MODELS']['rows_per_page_max'] are clamped, values not
+    in rows_per_page_choices (if set) are invalid.
+    '''
+    try:
+        rows_per_page = int(rows_per_page)
+    except (TypeError, ValueError):
+        return None
+
+    if rows_per_page < 1:
+        return None
+
+    choices = settings['MODELS']['rows_per_page_choices']
+    if choices and rows_per_page not in choices:
+        return None
+
+    return min(rows_per_page, settings['MODELS']['rows_per_page_max'])
+
+
 def _get_paginate_by(request, rows_per_page_var, context=None):
     paginate_by = 10  # default
 
     if settings['MODELS']['session_per_page_store']:
         # previously set value
-        paginate_by = request.session.get(rows_per_page_var, paginate_by)
+        paginate_by = _clean_rows_per_page(
+            request.session.get(rows_per_page_var)
+        ) or paginate_by
 
     if settings['MODELS']['db_per_page_store']:
-        try:
-            paginate = models.Paginate.objects.get(user_id=request.user.pk)
-        except models.Paginate.DoesNotExist:
-            paginate = None
-
-        if paginate:
-            rows_per_page_json = paginate.rows_per_page_json
-
-            # previously set value
-            paginate_by = rows_per_page_json.get(
-                rows_per_page_var, paginate_by
-            )
+        # previously set value
+        paginate_by = _clean_rows_per_page(
+            _get_rows_per_page_json(request).get(rows_per_page_var)
+        ) or paginate_by
 
-    rows_per_page = request.GET.get(rows_per_page_var, '').strip()
+    # invalid values are ignored before any query runs
+    rows_per_page = _clean_rows_per_page(
+        request.GET.get(rows_per_page_var, '').strip()
+    )
 
     if rows_per_page and paginate_by != rows_per_page:
         # new value
@@ -38,17 +100,7 @@ def _get_paginate_by(request, rows_per_page_var, context=None):
             request.session[rows_per_page_var] = paginate_by
 
         if settings['MODELS']['db_per_page_store']:
-            if not paginate:
-                paginate = models.Paginate.objects.create(
-                    user_id=request.user.pk
-                )
-
-                rows_per_page_json = paginate.rows_per_page_json
-
-            rows_per_page_json[rows_per_page_var] = paginate_by
-
-            paginate.rows_per_page_json = rows_per_page_json
-            paginate.save()
+            _set_rows_per_page(request, rows_per_page_var, paginate_by)
 
     if context:
         context[rows_per_page_var] = paginate_by
@@ -56,10 +108,53 @@ def _get_paginate_by(request, rows_per_page_var, context=None):
     return paginate_by
 
 
+def _get_related_fields(model):
+    '''Get names of the FK/OneToOne fields FieldList.get_all_fields reads.'''
+    return [
+        f.name for f in model._meta.fields
+        if f.editable and f.is_relation and (f.many_to_one or f.one_to_one)
+    ]
+
+
+def _prefetch_related_fields(queryset, hidden_fields=None, prefetch=None):
+    '''Fetch the related objects list_table.html reads with queryset.
+
+    Displayed columns are joined with select_related. hidden_fields are not
+    displayed but get_all_fields still reads them, they and prefetch (e.g.
+    FKs to a few wide rows repeated across the page) are fetched with one
+    prefetch_related query each instead of widening the join. Keeps a page
+    at a constant number of queries.
+    '''
+    skip = set(hidden_fields or ()) | set(prefetch or ())
+    names = _get_related_fields(queryset.model)
+    select = [name for name in names if name not in skip]
+    prefetch = [name for name in names if name in skip]
+
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+
+    return queryset
+
+
 # rows_per_page is usually the result of _get_paginate_by
-def _paginate(request, queryset, page_var, rows_per_page):
+# count is a paginator_utils counting strategy name or a Paginator class
+# prefetch_next defaults to UTILS['MODELS']['paginate_prefetch_next']
+def _paginate(request, queryset, page_var, rows_per_page, keyset=False,
+              count=None, prefetch_next=None):
+    if keyset:
+        return _keyset_paginate(request, queryset, page_var, rows_per_page)
+
+    if prefetch_next is None:
+        prefetch_next = settings['MODELS']['paginate_prefetch_next']
+
+    rows_per_page = _clean_rows_per_page(rows_per_page) or 10
     page = request.GET.get(page_var)
-    queryset_paginator = paginator.Paginator(queryset, rows_per_page)
+    paginator_class = paginator_utils.get_paginator_class(
+        count, prefetch_next=prefetch_next
+    )
+    queryset_paginator = paginator_class(queryset, rows_per_page)
     try:
         queryset = queryset_paginator.page(page)
     except paginator.PageNotAnInteger:
@@ -70,6 +165,166 @@ def _paginate(request, queryset, page_var, rows_per_page):
     return queryset
 
 
+CURSOR_SALT = 'utils.views_utils.cursor'
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class KeysetPage(collections.abc.Sequence):
+    '''A page of _keyset_paginate, render with keyset_pagination.html.
+
+    query_string is the request's query string without the cursor, links
+    add their own.
+    '''
+
+    def __init__(self, object_list, previous_cursor, next_cursor,
+                 query_string=''):
+        self.object_list = object_list
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+        self.query_string = query_string
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+def _get_keyset_ordering(queryset):
+    '''Get (field name, descending) pairs ordering queryset uniquely.'''
+    query = queryset.query
+    if query.order_by:
+        order_by = query.order_by
+    elif query.default_ordering:
+        order_by = queryset.model._meta.ordering
+    else:
+        order_by = []
+
+    ordering = []
+    for name in order_by:
+        if not isinstance(name, str) or name == '?':
+            raise ValueError(
+                'Keyset pagination requires field name ordering,'
+                ' got {!r}'.format(name)
+            )
+        descending = name.startswith('-')
+        ordering.append((name.lstrip('-+'), descending))
+
+    pk_names = ('pk', queryset.model._meta.pk.name)
+    if not any(name in pk_names for name, _descending in ordering):
+        # tiebreaker, cursors must identify a single row
+        descending = ordering[-1][1] if ordering else False
+        ordering.append(('pk', descending))
+
+    return ordering
+
+
+def _get_cursor_value(obj, name):
+    *path, attr = name.split('__')
+    for related in path:
+        obj = getattr(obj, related)
+        if obj is None:
+            return None
+    if attr != 'pk':
+        try:
+            # FKs by attname, their pk without fetching the related row
+            attr = getattr(obj._meta.get_field(attr), 'attname', attr)
+        except FieldDoesNotExist:
+            pass  # annotations
+    obj = getattr(obj, attr)
+    if not isinstance(obj, (int, float, str, bool, type(None))):
+        obj = str(obj)  # dates, decimals, uuids are parsed back by lookups
+
+    return obj
+
+
+def _get_cursor(obj, ordering, direction):
+    values = [_get_cursor_value(obj, name) for name, _desc in ordering]
+
+    return signing.dumps({'d': direction, 'v': values}, salt=CURSOR_SALT)
+
+
+def _get_keyset_filter(ordering, values, direction):
+    # (a > x) | (a = x & b > y) | (a = x & b = y & c > z) ...
+    keyset_filter = db_models.Q()
+    equal = {}
+    for (name, descending), value in zip(ordering, values):
+        after = descending if direction == PREVIOUS else not descending
+        lookup = '{}__{}'.format(name, 'gt' if after else 'lt')
+        keyset_filter |= db_models.Q(**{lookup: value}) & db_models.Q(**equal)
+        equal[name] = value
+
+    return keyset_filter
+
+
+def _keyset_paginate(request, queryset, cursor_var, rows_per_page):
+    '''Paginate by cursor instead of COUNT(*) and OFFSET.
+
+    Pages are fetched with a WHERE on the queryset's ordering (made unique
+    with pk) so page N costs the same as page 1. Cursors are opaque signed
+    tokens of the boundary row's ordering values. Ordering fields must not be
+    null.
+    '''
+    rows_per_page = _clean_rows_per_page(rows_per_page) or 10
+    ordering = _get_keyset_ordering(queryset)
+
+    direction = NEXT
+    try:
+        cursor = signing.loads(
+            request.GET.get(cursor_var, ''), salt=CURSOR_SALT
+        )
+        direction = cursor['d']
+        values = cursor['v']
+        if len(values) != len(ordering) or direction not in (NEXT, PREVIOUS):
+            raise ValueError('Cursor does not match ordering')
+    except (signing.BadSignature, ValueError, KeyError, TypeError):
+        cursor = None  # first page
+
+    order_by = [
+        ('-' if descending != (direction == PREVIOUS) else '') + name
+        for name, descending in ordering
+    ]
+    queryset = queryset.order_by(*order_by)
+    if cursor is not None:
+        queryset = queryset.filter(
+            _get_keyset_filter(ordering, values, direction)
+        )
+    # one extra row tells if there is another page
+    object_list = list(queryset[:rows_per_page + 1])
+    has_more = len(object_list) > rows_per_page
+    object_list = object_list[:rows_per_page]
+
+    if direction == PREVIOUS:
+        object_list.reverse()
+        has_previous, has_next = has_more, True
+    else:
+        has_previous, has_next = cursor is not None, has_more
+
+    previous_cursor = next_cursor = None
+    if object_list:
+        if has_previous:
+            previous_cursor = _get_cursor(object_list[0], ordering, PREVIOUS)
+        if has_next:
+            next_cursor = _get_cursor(object_list[-1], ordering, NEXT)
+
+    query = request.GET.copy()
+    query.pop(cursor_var, None)
+
+    return KeysetPage(
+        object_list, previous_cursor, next_cursor, query.urlencode()
+    )
+
+
 class PermissionMixin:
     permissions = None
 